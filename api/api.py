@@ -1,3 +1,4 @@
+import asyncio
 from logging.config import dictConfig
 
 from fastapi import (
@@ -6,12 +7,16 @@ from fastapi import (
     HTTPException,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer
 from google.auth.transport.requests import Request
 
-from api.routes import patient, gdrive, users, mri
+from api.routes import patient, gdrive, users, mri, metrics, uploads, inference
 from api.deps import const
+from api.deps.drive_async import drive_client
+from api.deps.executor import executors, ClientDisconnected, INFERENCE
+from api.deps.inference import ml_inference
+from api.deps.submissions import inference_submissions
 from api.deps.utils import APIException, get_localization_data
 
 log = const.LOGGING()
@@ -35,12 +40,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Accept-Ranges", "Content-Length", "Content-Range", "ETag"],
 )
 
 app.clients = {}
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
+@app.on_event("startup")
+async def startup():
+    if const.AZUREML.ENABLED is True:
+        # Not awaited, uploads don't wait for Azure credential discovery
+        app.inference_warm_up = asyncio.ensure_future(
+            executors.run(INFERENCE, ml_inference.warm_up)
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await inference_submissions.flush()
+    await drive_client.close()
+
+
 @app.exception_handler(APIException)
 async def api_exception_handler(
         request: Request(),
@@ -52,6 +73,15 @@ async def api_exception_handler(
     )
 
 
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(
+        request,
+        exc: ClientDisconnected,
+):
+    # Nobody reads the response, just finish request without error log
+    return Response(status_code=499)
+
+
 @app.exception_handler(HTTPException)
 async def validation_exception_handler(
         request,
@@ -79,3 +109,6 @@ app.include_router(users.router)
 app.include_router(patient.router)
 app.include_router(gdrive.router)
 app.include_router(mri.router)
+app.include_router(uploads.router)
+app.include_router(metrics.router)
+app.include_router(inference.router)
@@ -1,4 +1,5 @@
-from sqlalchemy import select, update, delete
+from sqlalchemy import and_, or_, select, update, delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import subqueryload
 from typing import Iterable 
@@ -55,15 +56,109 @@ async def get_patients() -> Iterable[m.Patient]:
 
 async def update_user_refresh_token(user_id: int, refresh_token: str | None):
     async with AsyncSession(m.engine) as session:
+        # Folder belongs to previously authorized Drive account
         stmt = (
             update(m.User)
             .where(m.User.id == user_id)
-            .values(refresh_token=refresh_token)
+            .values(
+                refresh_token=refresh_token,
+                drive_folder_id=None,
+                drive_page_token=None
+            )
         )
         await session.execute(stmt)
         await session.commit()
 
 
+async def get_user_drive_folder_id(user_id: int) -> str | None:
+    async with AsyncSession(m.engine) as session:
+        query = select(m.User.drive_folder_id).where(m.User.id == user_id)
+        result = await session.execute(query)
+
+    return result.scalars().first()
+
+
+async def update_user_drive_folder_id(user_id: int, folder_id: str | None):
+    async with AsyncSession(m.engine) as session:
+        # Index of previous folder has to be built again
+        stmt = (
+            update(m.User)
+            .where(m.User.id == user_id)
+            .values(drive_folder_id=folder_id, drive_page_token=None)
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def get_user_drive_page_token(user_id: int) -> str | None:
+    async with AsyncSession(m.engine) as session:
+        query = select(m.User.drive_page_token).where(m.User.id == user_id)
+        result = await session.execute(query)
+
+    return result.scalars().first()
+
+
+async def get_drive_files(user_id: int) -> Iterable[m.DriveFile]:
+    async with AsyncSession(m.engine) as session:
+        query = select(m.DriveFile).where(m.DriveFile.user_id == user_id)
+        result = await session.execute(query)
+
+    return result.scalars()
+
+
+async def replace_drive_files(user_id: int, files: list, page_token: str):
+    async with AsyncSession(m.engine) as session:
+        await session.execute(
+            delete(m.DriveFile).where(m.DriveFile.user_id == user_id)
+        )
+        if files:
+            await session.execute(
+                insert(m.DriveFile).on_conflict_do_nothing(),
+                [
+                    {"user_id": user_id, "file_id": f["id"], "name": f["name"]}
+                    for f in files
+                ]
+            )
+        await session.execute(
+            update(m.User)
+            .where(m.User.id == user_id)
+            .values(drive_page_token=page_token)
+        )
+        await session.commit()
+
+
+async def update_drive_files(
+    user_id: int,
+    updated: dict,
+    removed: set,
+    page_token: str
+):
+    async with AsyncSession(m.engine) as session:
+        if updated:
+            stmt = insert(m.DriveFile).values([
+                {"user_id": user_id, "file_id": file_id, "name": name}
+                for file_id, name in updated.items()
+            ])
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["user_id", "file_id"],
+                    set_={"name": stmt.excluded.name}
+                )
+            )
+        if removed:
+            await session.execute(
+                delete(m.DriveFile)
+                .where(m.DriveFile.user_id == user_id)
+                .where(m.DriveFile.file_id.in_(removed))
+            )
+        await session.execute(
+            update(m.User)
+            .where(m.User.id == user_id)
+            .values(drive_page_token=page_token)
+        )
+        await session.commit()
+
+
 async def update_user_associated_drive(user_id: int, email: str | None):
     async with AsyncSession(m.engine) as session:
         stmt = (
@@ -95,7 +190,7 @@ async def get_patient_by_id(patient_id: str) -> m.Patient:
     return result.scalars().first()
 
 
-async def create_mri_file(filename: str, file_id: str, patient_id: str, screening_id: int, user_id: int, series_uid: str):
+async def create_mri_file(filename: str, file_id: str, patient_id: str, screening_id: int, user_id: int, series_uid: str, content_hash: str = None):
     mri_file_model = m.MRIFile(
         filename=filename,
         file_id=file_id,
@@ -103,7 +198,8 @@ async def create_mri_file(filename: str, file_id: str, patient_id: str, screenin
         screening_id=screening_id,
         created_by=user_id,
         modified_by=user_id,
-        series_uid=series_uid
+        series_uid=series_uid,
+        content_hash=content_hash
     )
     async with AsyncSession(m.engine) as session:
         session.add(mri_file_model)
@@ -117,7 +213,8 @@ async def create_annotation_file(
         patient_id: str,
         user_id: int,
         mri_id: int,
-        is_ai: bool
+        is_ai: bool,
+        queued: bool = False
 ) -> int:
     async with AsyncSession(m.engine) as session:
         if name:
@@ -143,6 +240,7 @@ async def create_annotation_file(
             mri_file_id=mri_id,
             is_ai=is_ai,
             visible=False,
+            queued_at=datetime.now() if queued else None,
             created_by=user_id,
             modified_by=user_id
         )
@@ -180,6 +278,64 @@ async def get_mri_file_by_id(id: int) -> m.MRIFile:
     return result.scalars().first()
 
 
+async def get_mri_file_by_hash(
+        user_id: int,
+        content_hash: str,
+        screening_id: int
+) -> m.MRIFile:
+    # File of the same screening is preferred, it is reused as it is
+    async with AsyncSession(m.engine) as session:
+        query = (
+            select(m.MRIFile)
+            .where(
+                m.MRIFile.created_by == user_id,
+                m.MRIFile.content_hash == content_hash,
+                m.MRIFile.drive_missing == False
+            )
+            .order_by(
+                (m.MRIFile.screening_id == screening_id).desc(),
+                m.MRIFile.created_at
+            )
+        )
+        result = await session.execute(query)
+
+    return result.scalars().first()
+
+
+async def copy_ai_annotation(mri_id: int, new_mri_id: int, patient_id: str, user_id: int):
+    # AI annotation shares file (or running job) of the original
+    async with AsyncSession(m.engine) as session:
+        query = select(m.Annotation).where(
+            m.Annotation.mri_file_id == mri_id,
+            m.Annotation.is_ai == True,
+            m.Annotation.failed == False,
+            or_(m.Annotation.file_id != None, m.Annotation.job_name != None)
+        )
+        result = await session.execute(query)
+        annotation = result.scalars().first()
+        if annotation is None:
+            return
+
+        session.add(m.Annotation(
+            name=annotation.name,
+            filename=annotation.filename,
+            file_id=annotation.file_id,
+            mri_file_id=new_mri_id,
+            patient_id=patient_id,
+            is_ai=True,
+            visible=False,
+            job_name=annotation.job_name,
+            job_input=annotation.job_input,
+            job_started_at=annotation.job_started_at,
+            next_poll_at=annotation.next_poll_at,
+            poll_count=annotation.poll_count,
+            failed=annotation.failed,
+            created_by=user_id,
+            modified_by=user_id
+        ))
+        await session.commit()
+
+
 async def get_annotations_by_mri_and_user(mri_id: int, user_id: int) -> Iterable[m.Annotation]:
     async with AsyncSession(m.engine) as session:
         query = (
@@ -284,22 +440,78 @@ async def update_annotation_details(id: int, annotation: dict):
         await session.commit()
 
 
-async def start_inference(id: int, job: str):
+async def start_inferences(inputs: dict, job: str, next_poll_at: datetime):
+    # Annotation id -> name of its input file in job
     async with AsyncSession(m.engine) as session:
-        stmt = (
-            update(m.Annotation)
-            .where(m.Annotation.id == id)
-            .values({"job_name": job})
-        )
-        await session.execute(stmt)
+        for id, job_input in inputs.items():
+            stmt = (
+                update(m.Annotation)
+                .where(m.Annotation.id == id)
+                .values({
+                    "job_name": job,
+                    "queued_at": None,
+                    "job_input": job_input,
+                    "job_started_at": datetime.now(),
+                    "next_poll_at": next_poll_at,
+                    "poll_count": 0,
+                    "failed": False
+                })
+            )
+            await session.execute(stmt)
         await session.commit()
 
 
-async def get_running_inferences():
+async def get_running_inferences(due_at: datetime):
+    # Only jobs whose next status check is due
+    async with AsyncSession(m.engine) as session:
+        query = (
+            select(m.Annotation)
+            .where(
+                m.Annotation.job_name != None,
+                (m.Annotation.next_poll_at == None)
+                | (m.Annotation.next_poll_at <= due_at)
+            )
+            .options(subqueryload(m.Annotation.creator))
+            .options(subqueryload(m.Annotation.mri_file))
+        )
+        result = await session.execute(query)
+
+    return result.scalars().all()
+
+
+async def get_queued_inferences(queued_before: datetime):
+    # Staged MRIs whose job was not launched
+    async with AsyncSession(m.engine) as session:
+        query = (
+            select(m.Annotation)
+            .where(
+                m.Annotation.job_name == None,
+                m.Annotation.queued_at <= queued_before
+            )
+            .options(subqueryload(m.Annotation.mri_file))
+        )
+        result = await session.execute(query)
+
+    return result.scalars().all()
+
+
+async def get_inferences_by_ids(ids: Iterable[int]):
+    async with AsyncSession(m.engine) as session:
+        query = (
+            select(m.Annotation)
+            .where(m.Annotation.id.in_(ids))
+            .options(subqueryload(m.Annotation.mri_file))
+        )
+        result = await session.execute(query)
+
+    return result.scalars().all()
+
+
+async def get_inferences_by_job_name(job_name: str):
     async with AsyncSession(m.engine) as session:
         query = (
             select(m.Annotation)
-            .where(m.Annotation.job_name != None)
+            .where(m.Annotation.job_name == job_name)
             .options(subqueryload(m.Annotation.creator))
             .options(subqueryload(m.Annotation.mri_file))
         )
@@ -308,6 +520,39 @@ async def get_running_inferences():
     return result.scalars().all()
 
 
+async def reschedule_inferences(schedule: dict):
+    # Annotation id -> (next_poll_at, poll_count), polling is not modification
+    async with AsyncSession(m.engine) as session:
+        for id, (next_poll_at, poll_count) in schedule.items():
+            stmt = (
+                update(m.Annotation)
+                .where(m.Annotation.id == id)
+                .values(
+                    next_poll_at=next_poll_at,
+                    poll_count=poll_count,
+                    modified_at=m.Annotation.modified_at
+                )
+            )
+            await session.execute(stmt)
+        await session.commit()
+
+
+async def fail_inference(id: int):
+    async with AsyncSession(m.engine) as session:
+        stmt = (
+            update(m.Annotation)
+            .where(m.Annotation.id == id)
+            .values({
+                "job_name": None,
+                "queued_at": None,
+                "next_poll_at": None,
+                "failed": True
+            })
+        )
+        await session.execute(stmt)
+        await session.commit()
+
+
 async def update_mri_name(id: int, name: str):
     async with AsyncSession(m.engine) as session:
         stmt = (
@@ -388,7 +633,11 @@ async def get_screenings_series_by_patient_and_user(patient_id: str, user_id: in
             )
             .options(
                 subqueryload(m.Screening.mri_files)
-                .load_only(m.MRIFile.series_uid, m.MRIFile.file_id)
+                .load_only(
+                    m.MRIFile.series_uid,
+                    m.MRIFile.file_id,
+                    m.MRIFile.drive_missing
+                )
             )
         )
         result = await session.execute(query)
@@ -406,3 +655,62 @@ async def get_screening_by_id_and_user(screening_id: int, user_id: int) -> m.Scr
         result = await session.execute(query)
 
     return result.scalars().first()
+
+
+async def get_drive_users() -> Iterable[m.User]:
+    async with AsyncSession(m.engine) as session:
+        query = select(m.User).where(
+            m.User.refresh_token != None,
+            m.User.drive_folder_id != None
+        )
+        result = await session.execute(query)
+
+    return result.scalars().all()
+
+
+async def get_unindexed_file_ids(user_id: int) -> list:
+    indexed = (
+        select(m.DriveFile.file_id)
+        .where(m.DriveFile.user_id == user_id)
+    )
+    file_ids = []
+    async with AsyncSession(m.engine) as session:
+        for model in (m.MRIFile, m.Annotation):
+            query = select(model.file_id).where(
+                model.created_by == user_id,
+                model.file_id != None,
+                model.file_id.not_like("%:%"),
+                model.file_id.not_in(indexed)
+            )
+            result = await session.execute(query)
+            file_ids.extend(result.scalars().all())
+
+    return file_ids
+
+
+async def update_drive_missing(user_id: int, present: set = frozenset()):
+    # Flag files of user which are not in index of NeurAI folder,
+    # except those confirmed by Drive to exist
+    indexed = (
+        select(m.DriveFile.file_id)
+        .where(m.DriveFile.user_id == user_id)
+    )
+    async with AsyncSession(m.engine) as session:
+        for model in (m.MRIFile, m.Annotation):
+            missing = model.file_id.not_in(indexed)
+            if present:
+                missing = and_(missing, model.file_id.not_in(present))
+            # Flag is not user's modification, keep modified_at
+            stmt = (
+                update(model)
+                .where(
+                    model.created_by == user_id,
+                    model.file_id != None,
+                    # Keys of other storages than Drive are qualified
+                    model.file_id.not_like("%:%"),
+                    model.drive_missing != missing
+                )
+                .values(drive_missing=missing, modified_at=model.modified_at)
+            )
+            await session.execute(stmt)
+        await session.commit()
@@ -4,6 +4,7 @@ from datetime import datetime, date
 from sqlalchemy import (
     String,
     ForeignKey,
+    Index,
     UniqueConstraint
 )
 from sqlalchemy.ext.asyncio import create_async_engine
@@ -32,6 +33,8 @@ class User(Base):
     username: Mapped[str]
     password: Mapped[str]
     refresh_token: Mapped[str] = mapped_column(String(512), nullable=True)
+    drive_folder_id: Mapped[str] = mapped_column(nullable=True)
+    drive_page_token: Mapped[str] = mapped_column(nullable=True)
     authorized_email: Mapped[str] = mapped_column(nullable=True)
 
     mri_files = relationship(
@@ -52,6 +55,16 @@ class User(Base):
     )
 
 
+class DriveFile(Base):
+    __tablename__ = 'drive_files'
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete='CASCADE'), primary_key=True
+    )
+    file_id: Mapped[str] = mapped_column(primary_key=True)
+    name: Mapped[str]
+
+
 class Patient(Base):
     __tablename__ = 'patients'
 
@@ -110,13 +123,19 @@ class Screening(Base):
 
 class MRIFile(Base):
     __tablename__ = 'mri_files'
-    __table_args__ = (UniqueConstraint('filename', 'screening_id'),)
+    __table_args__ = (
+        UniqueConstraint('filename', 'screening_id'),
+        Index('ix_mri_files_created_by_content_hash', 'created_by', 'content_hash'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     filename: Mapped[str]
     file_id: Mapped[str]
     description: Mapped[str] = mapped_column(nullable=True)
     series_uid: Mapped[str] = mapped_column(nullable=True)
+    # SHA-256 of uploaded NIfTI or DICOM series, identical uploads are reused
+    content_hash: Mapped[str] = mapped_column(String(64), nullable=True)
+    drive_missing: Mapped[bool] = mapped_column(default=False)
     patient_id: Mapped[str] = mapped_column(
         String(20), ForeignKey("patients.id")
     )
@@ -152,7 +171,10 @@ class MRIFile(Base):
 
 class Annotation(Base):
     __tablename__ = 'annotations'
-    __table_args__ = (UniqueConstraint('name', 'mri_file_id'),)
+    __table_args__ = (
+        UniqueConstraint('name', 'mri_file_id'),
+        Index('ix_annotations_next_poll_at', 'next_poll_at'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
@@ -167,6 +189,13 @@ class Annotation(Base):
     is_ai: Mapped[bool] = mapped_column(default=False)
     visible: Mapped[bool] = mapped_column(default=False)
     job_name: Mapped[str] = mapped_column(nullable=True)
+    queued_at: Mapped[datetime] = mapped_column(nullable=True)
+    job_input: Mapped[str] = mapped_column(nullable=True)
+    job_started_at: Mapped[datetime] = mapped_column(nullable=True)
+    next_poll_at: Mapped[datetime] = mapped_column(nullable=True)
+    poll_count: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[bool] = mapped_column(default=False)
+    drive_missing: Mapped[bool] = mapped_column(default=False)
 
     created_at: Mapped[datetime] = mapped_column(default=datetime.now)
     created_by: Mapped[int] = mapped_column(
@@ -193,4 +222,10 @@ class Annotation(Base):
 
     @hybrid_property
     def ready(self):
-        return self.job_name == None
+        # Failed inference has no job, but also no file to download,
+        # staged one has neither job nor file yet
+        return (
+            (self.job_name == None)
+            & (self.queued_at == None)
+            & (self.failed == False)
+        )
@@ -1,13 +1,17 @@
+import hmac
+
 import jwt
 
 from fastapi import Depends, status
 from fastapi.security import OAuth2PasswordBearer
 
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-
 from api.db import crud
 from api.deps import const
+from api.deps import storage
+from api.deps.drive import drive_credentials
+from api.deps.drive_async import drive_client
+from api.deps.executor import executors, DRIVE
+from api.deps.throttle import is_retryable_error
 from api.deps.utils import APIException, get_logger, get_localization_data
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
@@ -64,41 +68,49 @@ async def validate_reset_token(token: str = Depends(oauth2_scheme), translation=
     return payload["user_id"]
 
 
+async def validate_callback_secret(
+    token: str = Depends(oauth2_scheme),
+    translation=Depends(get_localization_data)
+):
+    # Scoring side has no user, it authenticates with shared secret
+    secret = const.AZUREML.CALLBACK_SECRET
+    if not secret or not hmac.compare_digest(token.encode(), secret.encode()):
+        raise APIException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": translation["wrong_login"], "type": "auth"},
+        )
+
+
 async def validate_drive_token(
     user_id: int = Depends(validate_api_token),
     log=Depends(get_logger),
     translation=Depends(get_localization_data)
 ):
-    creds = None
-    token = None
-
     user = await crud.get_user_by_id(user_id=user_id)
     refresh_token = user.refresh_token
+    if not refresh_token and const.STORAGE.BACKEND != storage.DRIVE:
+        # Drive is needed only for files stored before storage was changed
+        return None
+
+    try:
+        if not refresh_token:
+            raise ValueError("Google Drive is not authorized")
 
-    if refresh_token:
-        web_creds = const.GoogleAPI.CREDS["web"]
-        creds = Credentials(
-            token,
-            refresh_token=refresh_token,
-            token_uri=web_creds["token_uri"],
-            client_id=web_creds["client_id"],
-            client_secret=web_creds["client_secret"],
-            scopes=const.GoogleAPI.SCOPES,
+        # Refresh of access token is blocking, only when cached one expires
+        creds = await executors.run(
+            DRIVE, drive_credentials.get, user_id, refresh_token
         )
+        folder_id = await drive_client.verify_folder(creds, user.drive_folder_id)
 
-    try:
-        service = build("drive", "v3", credentials=creds)
-        results = (
-            service.files()
-            .list(
-                q=const.GoogleAPI.CONTENT_FILTER,
-                fields="nextPageToken, files(id, name)",
+    except Exception as e:
+        if is_retryable_error(e):
+            # Token is fine, Drive is only busy
+            raise APIException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"message": translation["drive_rate_limited"]},
             )
-            .execute()
-        )
-        items = results.get("files", [])
 
-    except Exception:
+        drive_credentials.evict(user_id)
         log.info(
             f"User '{user.username}' used invalid refresh token for Google Drive.",
             extra={"topic": "GOOGLE"}
@@ -109,27 +121,16 @@ async def validate_drive_token(
         )
 
     # if the NeurAI file doesn't exist create one
-    if not items:
-        folder_metadata = {
-            "name": const.APP_NAME,
-            "mimeType": const.GoogleAPI.DRIVE_MIME_TYPE,
-        }
-        service.files().create(body=folder_metadata, fields="id").execute()
-
-        results = (
-            service.files()
-            .list(
-                q=const.GoogleAPI.CONTENT_FILTER,
-                fields="nextPageToken, files(id, name)",
-            )
-            .execute()
-        )
-        items = results.get("files", [])
-
-        if not items:
+    if folder_id is None:
+        try:
+            folder_id = await drive_client.create_folder(creds)
+        except Exception:
             raise APIException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 content={"message": translation["drive_folder_not_found"]},
             )
 
+    if folder_id != user.drive_folder_id:
+        await crud.update_user_drive_folder_id(user_id, folder_id)
+
     return creds
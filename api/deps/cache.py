@@ -0,0 +1,188 @@
+import os
+import time
+import tempfile
+import threading
+
+from api.deps import const
+
+
+class CacheWriter:
+    def __init__(self, cache: "DriveCache", file_id: str):
+        self.cache = cache
+        self.file_id = file_id
+        fd, self.temp_path = tempfile.mkstemp(
+            dir=cache.directory, prefix=DriveCache.TEMP_PREFIX
+        )
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.file.write(chunk)
+
+    def commit(self):
+        size = self.file.tell()
+        self.file.close()
+        # Atomic rename, other workers see either nothing or complete file
+        os.replace(self.temp_path, self.cache.path(self.file_id))
+        self.cache.added(size)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class DriveCache:
+    """
+    Bounded on-disk LRU cache of Drive file content keyed by file_id.
+    Files are stored as downloaded, so they stay encrypted with ENC key.
+    Directory can be shared by all workers, recency is tracked by mtime.
+    Total size is tracked in memory, directory is scanned only when it
+    exceeds limit (files of other workers are counted by that scan).
+    """
+    TEMP_PREFIX = ".tmp-"
+    TEMP_MAX_AGE_SECONDS = 60 * 60
+    # Eviction frees some space below limit, so full cache isn't scanned
+    # on every download
+    LOW_WATER_RATIO = 0.9
+
+    def __init__(self, directory: str, max_bytes: int, enabled: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Estimate of size of cache, None until first scan
+        self.total_bytes = None
+        self.lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, file_id: str) -> str:
+        # Drive file IDs consist of URL safe characters only
+        return os.path.join(self.directory, os.path.basename(file_id))
+
+    def _count(self, counter: str):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def open(self, file_id: str):
+        if not self.enabled:
+            return None
+
+        path = self.path(file_id)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self._count("hits")
+        return f
+
+    def size(self, file_id: str) -> int | None:
+        if not self.enabled:
+            return None
+        try:
+            return os.path.getsize(self.path(file_id))
+        except FileNotFoundError:
+            return None
+
+    def writer(self, file_id: str) -> CacheWriter | None:
+        if not self.enabled:
+            return None
+        return CacheWriter(self, file_id)
+
+    def remove(self, file_id: str):
+        if not self.enabled:
+            return
+        path = self.path(file_id)
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes = max(self.total_bytes - size, 0)
+
+    def added(self, size: int):
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += size
+            scan = self.total_bytes is None or self.total_bytes > self.max_bytes
+        if scan:
+            self.evict()
+
+    def _entries(self) -> list:
+        entries = []
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                if entry.name.startswith(self.TEMP_PREFIX):
+                    # Leftover of interrupted download in crashed worker
+                    if now - stat.st_mtime > self.TEMP_MAX_AGE_SECONDS:
+                        self._unlink(entry.path)
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _unlink(self, path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+
+        if total > self.max_bytes:
+            target = self.max_bytes * self.LOW_WATER_RATIO
+        else:
+            target = self.max_bytes
+
+        # Least recently used first
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            if self._unlink(path):
+                self._count("evictions")
+            total -= size
+
+        with self.lock:
+            self.total_bytes = total
+
+    def stats(self) -> dict:
+        entries = self._entries() if self.enabled else []
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "size_bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes
+        }
+
+
+drive_cache = DriveCache(
+    directory=const.CACHE.DIR,
+    max_bytes=const.CACHE.MAX_BYTES,
+    enabled=const.CACHE.ENABLED
+)
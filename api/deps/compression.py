@@ -0,0 +1,66 @@
+import zlib
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from api.deps import const
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=const.COMPRESSION.WORKERS,
+            thread_name_prefix="gzip"
+        )
+    return _executor
+
+
+def is_gzip(f) -> bool:
+    position = f.tell()
+    magic = f.read(len(GZIP_MAGIC))
+    f.seek(position)
+    return magic == GZIP_MAGIC
+
+
+def _gzip_member(block: bytes, level: int) -> bytes:
+    # wbits=31 produces complete gzip member (header, deflate, trailer)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+def parallel_gzip(f, level: int = None, block_size: int = None) -> BytesIO:
+    """
+    Compress file object into concatenation of independently compressed
+    gzip members (like pigz), which is still valid gzip stream. Blocks are
+    compressed in threads, zlib releases GIL while compressing.
+    """
+    level = const.COMPRESSION.LEVEL if level is None else level
+    block_size = const.COMPRESSION.BLOCK_SIZE if block_size is None else block_size
+    executor = _get_executor()
+    max_pending = const.COMPRESSION.WORKERS * 2
+
+    output = BytesIO()
+    pending = deque()
+    while True:
+        block = f.read(block_size)
+        if block:
+            pending.append(executor.submit(_gzip_member, block, level))
+
+        # Bound number of blocks held in memory, keep output order
+        while pending and (len(pending) >= max_pending or not block):
+            output.write(pending.popleft().result())
+
+        if not block:
+            break
+
+    if output.tell() == 0:
+        output.write(_gzip_member(b"", level))
+
+    output.seek(0)
+    return output
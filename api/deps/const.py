@@ -26,6 +26,46 @@ class GoogleAPI:
     DRIVE_MIME_TYPE = "application/vnd.google-apps.folder"
     CONTENT_FILTER = f'mimeType = "{DRIVE_MIME_TYPE}" and name="{APP_NAME}"'
 
+    # Resumable upload chunk, has to be multiple of 256 KiB
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("DRIVE_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DRIVE_DOWNLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+
+    # Pooled async client for Drive requests from event loop
+    HTTP2 = bool(os.environ.get("DRIVE_HTTP2", "1") == '1')
+    MAX_CONNECTIONS = int(os.environ.get("DRIVE_MAX_CONNECTIONS", 100))
+    TIMEOUT_SECONDS = float(os.environ.get("DRIVE_TIMEOUT_SECONDS", 60))
+
+    # Cached access token is refreshed when it expires in less than this
+    TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get("DRIVE_TOKEN_REFRESH_MARGIN_SECONDS", 5 * 60))
+
+    # Files deleted in Drive are flagged in background, not on every listing
+    RECONCILE_INTERVAL = os.environ.get("DRIVE_RECONCILE_INTERVAL", "5 minutes")
+
+    # "fake" serves Drive from memory of the process, for load testing
+    BACKEND = os.environ.get("DRIVE_BACKEND", "google")
+
+
+class DRIVE_THROTTLE:
+    # Drive allows about 1000 requests per 100 seconds per user
+    RATE = float(os.environ.get("DRIVE_THROTTLE_RATE", 10))
+    BURST = int(os.environ.get("DRIVE_THROTTLE_BURST", 20))
+    MAX_RETRIES = int(os.environ.get("DRIVE_THROTTLE_MAX_RETRIES", 5))
+    BACKOFF_BASE_SECONDS = float(os.environ.get("DRIVE_THROTTLE_BACKOFF_BASE_SECONDS", 1))
+    BACKOFF_MAX_SECONDS = float(os.environ.get("DRIVE_THROTTLE_BACKOFF_MAX_SECONDS", 32))
+    UPLOAD_LIMIT = int(os.environ.get("DRIVE_THROTTLE_UPLOAD_LIMIT", 4))
+
+
+class FAKE_DRIVE:
+    LATENCY_MS = float(os.environ.get("FAKE_DRIVE_LATENCY_MS", 50))
+    LATENCY_JITTER_MS = float(os.environ.get("FAKE_DRIVE_LATENCY_JITTER_MS", 50))
+    # Bytes per second of uploads and downloads, 0 is unlimited
+    BANDWIDTH = int(os.environ.get("FAKE_DRIVE_BANDWIDTH", 0))
+    # Fraction of requests failed with 503
+    ERROR_RATE = float(os.environ.get("FAKE_DRIVE_ERROR_RATE", 0))
+    # Requests per second of each user, over quota answer 403, 0 is unlimited
+    QUOTA_RATE = float(os.environ.get("FAKE_DRIVE_QUOTA_RATE", 0))
+    QUOTA_BURST = int(os.environ.get("FAKE_DRIVE_QUOTA_BURST", 100))
+
 
 class CORS:
     ORIGINS = [
@@ -46,12 +86,95 @@ class ENC:
     SIG = base64.b64decode(bytes(os.environ.get("ENC_SIG"), "utf-8"))
 
 
+class COMPRESSION:
+    LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+    BLOCK_SIZE = int(os.environ.get("GZIP_BLOCK_SIZE", 1024 * 1024))
+    WORKERS = int(os.environ.get("GZIP_WORKERS", os.cpu_count() or 1))
+
+
+class DICOM:
+    # Elements larger than this are not read during header validation
+    DEFER_SIZE = "1 KB"
+    VALIDATION_WORKERS = int(os.environ.get("DICOM_VALIDATION_WORKERS", 8))
+    CONVERSION_WORKERS = int(os.environ.get("DICOM_CONVERSION_WORKERS", 2))
+    # Same filesystem as upload job spool allows hard links, tmpfs avoids disk
+    SCRATCH_DIR = os.environ.get("DICOM_SCRATCH_DIR") or None
+
+
+class EXECUTOR:
+    # Concurrency limits per category of blocking work in one worker
+    CONVERT_LIMIT = int(os.environ.get("EXECUTOR_CONVERT_LIMIT", 2))
+    CRYPTO_LIMIT = int(os.environ.get("EXECUTOR_CRYPTO_LIMIT", 4))
+    DRIVE_LIMIT = int(os.environ.get("EXECUTOR_DRIVE_LIMIT", 16))
+    INFERENCE_LIMIT = int(os.environ.get("EXECUTOR_INFERENCE_LIMIT", 2))
+    STORAGE_LIMIT = int(os.environ.get("EXECUTOR_STORAGE_LIMIT", 16))
+    # Status checks of inference jobs, bounds fan-out of scheduler
+    POLL_LIMIT = int(os.environ.get("EXECUTOR_POLL_LIMIT", 8))
+
+
+class UPLOAD_JOBS:
+    SPOOL_DIR = os.environ.get("UPLOAD_JOBS_SPOOL_DIR", "/var/spool/neurai/jobs")
+    SPOOL_CHUNK_SIZE = 1024 * 1024
+    RETENTION_SECONDS = 60 * 60
+
+
+class UPLOAD_SESSIONS:
+    DIR = os.environ.get("UPLOAD_SESSIONS_DIR", "/var/spool/neurai/sessions")
+    MAX_FILES = int(os.environ.get("UPLOAD_SESSIONS_MAX_FILES", 5000))
+    MAX_BYTES = int(os.environ.get("UPLOAD_SESSIONS_MAX_BYTES", 4 * 1024 ** 3))
+    RETENTION_SECONDS = int(os.environ.get("UPLOAD_SESSIONS_RETENTION_SECONDS", 24 * 60 * 60))
+
+
+class STORAGE:
+    # Where new files are stored: "drive", "local" or "s3"
+    BACKEND = os.environ.get("STORAGE_BACKEND", "drive")
+    LOCAL_DIR = os.environ.get("STORAGE_LOCAL_DIR", "/var/lib/neurai/files")
+    S3_BUCKET = os.environ.get("STORAGE_S3_BUCKET", "neurai")
+    S3_PREFIX = os.environ.get("STORAGE_S3_PREFIX", "")
+    # Endpoint of S3-compatible service (e.g. MinIO), AWS when empty
+    S3_ENDPOINT_URL = os.environ.get("STORAGE_S3_ENDPOINT_URL") or None
+    S3_REGION = os.environ.get("STORAGE_S3_REGION") or None
+    S3_ACCESS_KEY_ID = os.environ.get("STORAGE_S3_ACCESS_KEY_ID") or None
+    S3_SECRET_ACCESS_KEY = os.environ.get("STORAGE_S3_SECRET_ACCESS_KEY") or None
+
+
+class CACHE:
+    ENABLED = bool(os.environ.get("DRIVE_CACHE_ENABLED") == '1')
+    DIR = os.environ.get("DRIVE_CACHE_DIR", "/var/cache/neurai")
+    MAX_BYTES = int(os.environ.get("DRIVE_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+
 class AZUREML:
     SUBSCRIPTION_ID = os.environ.get("AZURE_ML_SUBSCRIPTION_ID")
     RESOURCE_GROUP = os.environ.get("AZURE_ML_RESOURCE_GROUP")
     WORKSPACE = os.environ.get("AZURE_ML_WORKSPACE")
     ENDPOINT = os.environ.get("AZURE_ML_ENDPOINT")
     ENABLED = bool(os.environ.get("AZURE_ML_ENABLED") == '1')
+    # Cached token is refreshed in background when it expires in less than this
+    TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get("AZURE_ML_TOKEN_REFRESH_MARGIN_SECONDS", 10 * 60))
+    # Finished jobs whose results are downloaded and stored concurrently
+    RESULT_WORKERS = int(os.environ.get("AZURE_ML_RESULT_WORKERS", 2))
+    # First status check around typical duration of inference, then checks
+    # back off exponentially from interval up to maximum
+    POLL_FIRST_SECONDS = int(os.environ.get("AZURE_ML_POLL_FIRST_SECONDS", 4 * 60))
+    POLL_INTERVAL_SECONDS = int(os.environ.get("AZURE_ML_POLL_INTERVAL_SECONDS", 60))
+    POLL_MAX_SECONDS = int(os.environ.get("AZURE_ML_POLL_MAX_SECONDS", 15 * 60))
+    # Jobs running longer are canceled and their annotations marked failed
+    JOB_TIMEOUT_SECONDS = int(os.environ.get("AZURE_ML_JOB_TIMEOUT_SECONDS", 2 * 60 * 60))
+    # MRIs sent to inference within window are scored by one batch job
+    BATCH_WINDOW_SECONDS = float(os.environ.get("AZURE_ML_BATCH_WINDOW_SECONDS", 10))
+    BATCH_SIZE = int(os.environ.get("AZURE_ML_BATCH_SIZE", 50))
+    # Staged MRIs not launched within this were lost with restarted process,
+    # their annotations are marked failed
+    LAUNCH_TIMEOUT_SECONDS = int(os.environ.get("AZURE_ML_LAUNCH_TIMEOUT_SECONDS", 15 * 60))
+    # Scoring script calls back with this secret when it finishes, polling
+    # is then only safety net for lost callbacks
+    CALLBACK_SECRET = os.environ.get("AZURE_ML_CALLBACK_SECRET")
+    CALLBACK_ENABLED = bool(CALLBACK_SECRET)
+    # Job is still finalized after callback, it is checked this often until
+    # it completes or wait runs out
+    CALLBACK_POLL_SECONDS = int(os.environ.get("AZURE_ML_CALLBACK_POLL_SECONDS", 5))
+    CALLBACK_WAIT_SECONDS = int(os.environ.get("AZURE_ML_CALLBACK_WAIT_SECONDS", 3 * 60))
 
 
 class LOGGING:
@@ -0,0 +1,89 @@
+import time
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import dicom2nifti
+from dicom2nifti.exceptions import ConversionValidationError
+
+
+def convert_dicom_series(directory: str, output_path: str) -> float | None:
+    # Runs in worker process, result is written into output_path
+    start = time.perf_counter()
+    try:
+        dicom2nifti.dicom_series_to_nifti(
+            Path(directory), Path(output_path), reorient_nifti=True
+        )
+    except ConversionValidationError:
+        # Not enough slices (<4) or inconsistent slice increment
+        return None
+
+    return time.perf_counter() - start
+
+
+class ConversionPool:
+    """
+    Process pool for DICOM to NIfTI conversion with queue statistics.
+    Workers are spawned (not forked), so they don't inherit server state.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.conversions = 0
+        self.failures = 0
+        self.convert_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.last_convert_seconds = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    def convert(self, directory: str, output_path: str) -> bool:
+        executor = self._get_executor()
+        with self.lock:
+            self.in_flight += 1
+
+        submitted = time.perf_counter()
+        try:
+            convert_seconds = executor.submit(
+                convert_dicom_series, directory, output_path
+            ).result()
+        finally:
+            total_seconds = time.perf_counter() - submitted
+            with self.lock:
+                self.in_flight -= 1
+
+        with self.lock:
+            if convert_seconds is None:
+                self.failures += 1
+                return False
+
+            self.conversions += 1
+            self.last_convert_seconds = convert_seconds
+            self.convert_seconds += convert_seconds
+            self.queue_seconds += max(total_seconds - convert_seconds, 0.0)
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            count = self.conversions or 1
+            return {
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "queued": max(self.in_flight - self.workers, 0),
+                "conversions": self.conversions,
+                "failures": self.failures,
+                "last_convert_seconds": self.last_convert_seconds,
+                "avg_convert_seconds": self.convert_seconds / count,
+                "avg_queue_seconds": self.queue_seconds / count
+            }
@@ -0,0 +1,74 @@
+import io
+import os
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from buffered_encryption.aesctr import ReadOnlyEncryptedFile
+
+from api.deps import const
+
+
+BLOCK_SIZE = ReadOnlyEncryptedFile.BLOCK_SIZE
+
+
+def ctr_cipher(offset: int = 0):
+    # AES-CTR keystream positioned at arbitrary byte offset, compatible with
+    # buffered_encryption (counter = nonce + block index, big-endian)
+    counter = ReadOnlyEncryptedFile.add_int_to_bytes(
+        const.ENC.SIG, offset // BLOCK_SIZE
+    )
+    cipher = Cipher(algorithms.AES(const.ENC.KEY), modes.CTR(counter)).encryptor()
+
+    # Discard keystream bytes preceding offset inside of the first block
+    cipher.update(bytes(offset % BLOCK_SIZE))
+    return cipher
+
+
+class EncryptedReader(io.RawIOBase):
+    """
+    Seekable read-only view of plaintext stream as its AES-CTR ciphertext.
+    Encryption happens lazily in read(), so only requested chunk is held
+    in memory. CTR mode preserves length, ciphertext size equals plaintext.
+    """
+
+    def __init__(self, plaintext):
+        self.plaintext = plaintext
+        self.position = 0
+        self.cipher = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self.position + offset
+        elif whence == os.SEEK_END:
+            position = self.plaintext.seek(0, os.SEEK_END) + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+
+        if position != self.position:
+            self.cipher = None
+        self.position = position
+        return position
+
+    def read(self, size: int = -1) -> bytes:
+        if self.cipher is None:
+            self.cipher = ctr_cipher(self.position)
+
+        self.plaintext.seek(self.position)
+        chunk = self.plaintext.read(size)
+        self.position += len(chunk)
+        return self.cipher.update(chunk)
+
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
@@ -0,0 +1,218 @@
+import json
+import datetime
+import threading
+import weakref
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+
+from api.deps import const
+from api.deps.drive_fake import fake_drive
+
+
+# Maximum number of calls in one request to Drive batch endpoint
+BATCH_LIMIT = 100
+
+_discovery_document = None
+
+
+def service(creds: Credentials):
+    """
+    Drive service for given credentials. Services are cheap to build from
+    parsed discovery document, but they are not thread safe, so each request
+    builds its own. Shared part is credentials with their access token.
+    Without credentials (Drive not authorized) there is no service.
+    Building doesn't block, so it is safe on event loop. Credentials come
+    fresh from DriveCredentials.get, which callers run in executor.
+    """
+    global _discovery_document
+    if creds is None:
+        return None
+
+    if _discovery_document is None:
+        _discovery_document = json.loads(
+            discovery_cache.get_static_doc("drive", "v3")
+        )
+
+    if fake_drive is not None:
+        http = AuthorizedHttp(creds, http=fake_drive.http())
+        return build_from_document(_discovery_document, http=http)
+    return build_from_document(_discovery_document, credentials=creds)
+
+
+def execute_batch(service, requests: list) -> list:
+    # Results in order of requests, failed call is represented by its HttpError
+    results = [None] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = response if exception is None else exception
+
+    for offset in range(0, len(requests), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=callback)
+        for i, request in enumerate(requests[offset:offset + BATCH_LIMIT], offset):
+            batch.add(request, request_id=str(i))
+        # Rate limited items come back as their HttpError, callers retry them
+        batch.execute()
+
+    return results
+
+
+def list_folder(service, folder_id: str) -> list:
+    files = []
+    page_token = None
+
+    while True:
+        response = service.files().list(
+            q=f"'{folder_id}' in parents and trashed=false",
+            fields="nextPageToken, files(id, name)",
+            pageSize=1000,
+            pageToken=page_token
+        ).execute(num_retries=const.DRIVE_THROTTLE.MAX_RETRIES)
+
+        files.extend(response.get("files", []))
+        page_token = response.get("nextPageToken", None)
+
+        if page_token is None:
+            break
+
+    return files
+
+
+def start_page_token(service) -> str:
+    return service.changes().getStartPageToken().execute(
+        num_retries=const.DRIVE_THROTTLE.MAX_RETRIES
+    )["startPageToken"]
+
+
+def list_changes(service, page_token: str, folder_id: str) -> tuple:
+    # Files added to (or renamed in) folder and ids of files which left it
+    # since page_token, with token for next call
+    updated = {}
+    removed = set()
+
+    while True:
+        response = service.changes().list(
+            pageToken=page_token,
+            spaces="drive",
+            pageSize=1000,
+            fields=(
+                "nextPageToken, newStartPageToken, "
+                "changes(fileId, removed, file(name, parents, trashed))"
+            )
+        ).execute(num_retries=const.DRIVE_THROTTLE.MAX_RETRIES)
+
+        # Changes are ordered, later change of the same file wins
+        for change in response.get("changes", []):
+            file_id = change["fileId"]
+            file = change.get("file")
+            if (
+                change.get("removed")
+                or file is None
+                or file.get("trashed")
+                or folder_id not in file.get("parents", [])
+            ):
+                updated.pop(file_id, None)
+                removed.add(file_id)
+            else:
+                removed.discard(file_id)
+                updated[file_id] = file["name"]
+
+        if "newStartPageToken" in response:
+            return updated, removed, response["newStartPageToken"]
+        page_token = response["nextPageToken"]
+
+
+class DriveCredentials:
+    """
+    Process wide cache of per-user Google credentials. Access token is reused
+    until shortly before its expiration, then exactly one thread refreshes it
+    while others wait for the result.
+    """
+
+    def __init__(self, refresh_margin_seconds: int):
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self.entries = {}
+        self.refresh_locks = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _create(self, refresh_token: str) -> Credentials:
+        web_creds = const.GoogleAPI.CREDS["web"]
+        return Credentials(
+            None,
+            refresh_token=refresh_token,
+            token_uri=web_creds["token_uri"],
+            client_id=web_creds["client_id"],
+            client_secret=web_creds["client_secret"],
+            scopes=const.GoogleAPI.SCOPES,
+        )
+
+    def is_fresh(self, creds: Credentials) -> bool:
+        # Expiry of google-auth credentials is naive UTC datetime
+        now = datetime.datetime.utcnow()
+        return (
+            creds.token is not None
+            and creds.expiry is not None
+            and creds.expiry - self.refresh_margin > now
+        )
+
+    def ensure_fresh(self, creds: Credentials):
+        if self.is_fresh(creds):
+            return
+
+        with self.lock:
+            refresh_lock = self.refresh_locks.setdefault(creds, threading.Lock())
+
+        with refresh_lock:
+            # Token could be refreshed while waiting for lock
+            if self.is_fresh(creds):
+                return
+            if fake_drive is not None:
+                fake_drive.refresh(creds)
+            else:
+                creds.refresh(Request())
+            with self.lock:
+                self.refreshes += 1
+
+    def invalidate(self, creds: Credentials, token: str):
+        # Drive rejected token, next use refreshes it (unless it already was)
+        with self.lock:
+            if creds.token == token:
+                creds.expiry = None
+
+    def get(self, user_id: int, refresh_token: str) -> Credentials:
+        with self.lock:
+            creds = self.entries.get(user_id)
+            if creds is None or creds.refresh_token != refresh_token:
+                # First use or user authorized Drive again
+                creds = self._create(refresh_token)
+                self.entries[user_id] = creds
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        self.ensure_fresh(creds)
+        return creds
+
+    def evict(self, user_id: int):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes
+            }
+
+
+drive_credentials = DriveCredentials(
+    refresh_margin_seconds=const.GoogleAPI.TOKEN_REFRESH_MARGIN_SECONDS
+)
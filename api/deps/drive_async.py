@@ -0,0 +1,275 @@
+import os
+import json
+import asyncio
+from typing import Callable
+
+import httpx
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from api.deps import const
+from api.deps.drive import drive_credentials
+from api.deps.drive_fake import fake_drive
+from api.deps.executor import executors, CRYPTO, DRIVE
+from api.deps.throttle import drive_throttle, user_key, NON_IDEMPOTENT_METHODS
+
+
+API_URL = "https://www.googleapis.com/drive/v3"
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3"
+
+# Resumable upload session answers this for every chunk but the last one
+RESUME_INCOMPLETE = 308
+
+
+def http_error(response: httpx.Response) -> HttpError:
+    # Same exception as googleapiclient raises, so callers handle both alike
+    resp = httplib2.Response({"status": response.status_code, **response.headers})
+    resp.reason = response.reason_phrase
+    return HttpError(resp, response.content, uri=str(response.url))
+
+
+def transport_error(request: httpx.Request, e: httpx.TransportError) -> HttpError:
+    # Drive unreachable after retries, callers handle it as unavailable Drive
+    resp = httplib2.Response({"status": 503})
+    resp.reason = "Service Unavailable"
+    content = json.dumps({"error": {
+        "errors": [{"reason": "backendError", "message": str(e)}],
+        "code": 503,
+        "message": str(e)
+    }}).encode()
+    return HttpError(resp, content, uri=str(request.url))
+
+
+class AsyncDriveClient:
+    """
+    Drive v3 client for async code. All requests share one pooled HTTP
+    client with keep-alive (HTTP/2 when enabled), so neither event loop is
+    blocked nor TLS handshake repeated. Failures raise HttpError like
+    googleapiclient does.
+    """
+
+    def __init__(self, http2: bool, max_connections: int, timeout: float):
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=self.timeout,
+                transport=fake_drive.transport() if fake_drive is not None else None
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def _token(self, creds: Credentials) -> str:
+        if not drive_credentials.is_fresh(creds):
+            # Refresh is blocking call of google-auth
+            await executors.run(DRIVE, drive_credentials.ensure_fresh, creds)
+        return creds.token
+
+    async def request(
+        self,
+        creds: Credentials,
+        method: str,
+        url: str,
+        headers: dict | None = None,
+        idempotent: bool | None = None,
+        **kwargs
+    ) -> httpx.Response:
+        client = self._get_client()
+        key = user_key(creds)
+        if idempotent is None:
+            idempotent = method.upper() not in NON_IDEMPOTENT_METHODS
+        attempt = 0
+        auth_retried = False
+        while True:
+            await drive_throttle.acquire(key)
+            token = await self._token(creds)
+            request = client.build_request(
+                method,
+                url,
+                headers={**(headers or {}), "Authorization": f"Bearer {token}"},
+                **kwargs
+            )
+            try:
+                response = await client.send(request)
+            except httpx.TransportError as e:
+                # Connection reset or timed out
+                if not drive_throttle.should_retry(attempt, idempotent=idempotent):
+                    raise transport_error(request, e) from e
+                await asyncio.sleep(drive_throttle.backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code == 401 and not auth_retried:
+                # Token revoked or expired sooner than expected, retry once
+                drive_credentials.invalidate(creds, token)
+                auth_retried = True
+                continue
+
+            if response.is_error:
+                if drive_throttle.should_retry(
+                    attempt, response.status_code, response.content, idempotent
+                ):
+                    await asyncio.sleep(drive_throttle.backoff(
+                        attempt, response.headers.get("Retry-After")
+                    ))
+                    attempt += 1
+                    continue
+                raise http_error(response)
+            return response
+
+    async def list_files(
+        self,
+        creds: Credentials,
+        q: str,
+        fields: str = "nextPageToken, files(id, name)"
+    ) -> list:
+        files = []
+        params = {"q": q, "fields": fields, "pageSize": 1000}
+        while True:
+            response = await self.request(
+                creds, "GET", f"{API_URL}/files", params=params
+            )
+            result = response.json()
+            files.extend(result.get("files", []))
+            if "nextPageToken" not in result:
+                return files
+            params["pageToken"] = result["nextPageToken"]
+
+    async def get_file(self, creds: Credentials, file_id: str, fields: str) -> dict:
+        response = await self.request(
+            creds, "GET", f"{API_URL}/files/{file_id}", params={"fields": fields}
+        )
+        return response.json()
+
+    async def create_file(
+        self,
+        creds: Credentials,
+        metadata: dict,
+        fields: str = "id"
+    ) -> dict:
+        # Metadata only, e.g. folder
+        response = await self.request(
+            creds, "POST", f"{API_URL}/files",
+            params={"fields": fields}, json=metadata
+        )
+        return response.json()
+
+    async def about(self, creds: Credentials, fields: str) -> dict:
+        response = await self.request(
+            creds, "GET", f"{API_URL}/about", params={"fields": fields}
+        )
+        return response.json()
+
+    async def upload_resumable(
+        self,
+        creds: Credentials,
+        metadata: dict,
+        reader,
+        mimetype: str = "application/octet-stream",
+        fields: str = "id,name,createdTime",
+        progress: Callable | None = None
+    ) -> dict:
+        # Reader has to be seekable, chunk is read again if Drive didn't
+        # receive it whole
+        async with drive_throttle.upload_slot():
+            return await self._upload_resumable(
+                creds, metadata, reader, mimetype, fields, progress
+            )
+
+    async def _upload_resumable(
+        self,
+        creds: Credentials,
+        metadata: dict,
+        reader,
+        mimetype: str,
+        fields: str,
+        progress: Callable | None
+    ) -> dict:
+        size = reader.seek(0, os.SEEK_END)
+        response = await self.request(
+            creds, "POST", f"{UPLOAD_URL}/files",
+            params={"uploadType": "resumable", "fields": fields},
+            headers={
+                "X-Upload-Content-Type": mimetype,
+                "X-Upload-Content-Length": str(size)
+            },
+            json=metadata,
+            # Only opens upload session, repeated one is just abandoned
+            idempotent=True
+        )
+        session_url = response.headers["Location"]
+
+        offset = 0
+        while True:
+            reader.seek(offset)
+            chunk = await executors.run(
+                CRYPTO, reader.read, const.GoogleAPI.UPLOAD_CHUNK_SIZE
+            )
+            if chunk:
+                content_range = f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+            else:
+                content_range = f"bytes */{size}"
+
+            response = await self.request(
+                creds, "PUT", session_url,
+                headers={"Content-Range": content_range},
+                content=chunk
+            )
+            if response.status_code != RESUME_INCOMPLETE:
+                return response.json()
+
+            # Range of persisted bytes "bytes=0-N", missing when nothing was
+            received = response.headers.get("Range")
+            offset = int(received.rpartition("-")[2]) + 1 if received else 0
+            if progress is not None:
+                progress("uploading", offset / size)
+
+    async def find_folder(self, creds: Credentials) -> str | None:
+        # Search for NeurAI folder, only when its id is not known
+        items = await self.list_files(creds, const.GoogleAPI.CONTENT_FILTER)
+        if not items:
+            return None
+
+        return items[0]["id"]
+
+    async def create_folder(self, creds: Credentials) -> str:
+        folder = await self.create_file(creds, {
+            "name": const.APP_NAME,
+            "mimeType": const.GoogleAPI.DRIVE_MIME_TYPE,
+        })
+        return folder["id"]
+
+    async def verify_folder(self, creds: Credentials, folder_id: str | None) -> str | None:
+        # Stored folder id costs single get, it is searched again only
+        # when Drive doesn't know it anymore
+        if folder_id is not None:
+            try:
+                folder = await self.get_file(creds, folder_id, "id, trashed")
+                if not folder.get("trashed"):
+                    return folder_id
+            except HttpError as e:
+                if e.status_code != 404:
+                    raise
+
+        return await self.find_folder(creds)
+
+
+drive_client = AsyncDriveClient(
+    http2=const.GoogleAPI.HTTP2,
+    max_connections=const.GoogleAPI.MAX_CONNECTIONS,
+    timeout=const.GoogleAPI.TIMEOUT_SECONDS
+)
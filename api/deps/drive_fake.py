@@ -0,0 +1,458 @@
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import datetime
+import threading
+from http import HTTPStatus
+from email.parser import FeedParser
+from urllib.parse import urlsplit, parse_qsl
+
+import httpx
+import httplib2
+from google.oauth2.credentials import Credentials
+
+from api.deps import const
+
+
+ROOT_URL = "https://www.googleapis.com"
+TOKEN_LIFETIME_SECONDS = 60 * 60
+
+CLAUSE_PARENT = re.compile(r"^'([^']*)' in parents$")
+CLAUSE_FIELD = re.compile(r"""^(\w+)\s*(!?=)\s*(?:'([^']*)'|"([^"]*)"|(true|false))$""")
+
+
+def error(status: int, reason: str, message: str) -> tuple:
+    body = {
+        "error": {
+            "errors": [{"domain": "global", "reason": reason, "message": message}],
+            "code": status,
+            "message": message
+        }
+    }
+    return status, {"content-type": "application/json"}, json.dumps(body).encode()
+
+
+def ok(body: dict, status: int = 200) -> tuple:
+    return status, {"content-type": "application/json"}, json.dumps(body).encode()
+
+
+def parse_query(q: str) -> list:
+    # Subset of Drive search syntax used by the app, clauses joined by "and"
+    clauses = []
+    if not q:
+        return clauses
+
+    for clause in q.split(" and "):
+        clause = clause.strip()
+        match = CLAUSE_PARENT.match(clause)
+        if match:
+            clauses.append(("parents", "in", match.group(1)))
+            continue
+
+        match = CLAUSE_FIELD.match(clause)
+        if match is None:
+            raise ValueError(f"Unsupported query clause: {clause}")
+        field, operator, single, double, boolean = match.groups()
+        if boolean:
+            value = boolean == "true"
+        else:
+            value = single if single is not None else double
+        clauses.append((field, operator, value))
+    return clauses
+
+
+def matches(file: dict, clauses: list) -> bool:
+    for field, operator, value in clauses:
+        if operator == "in":
+            if value not in file["parents"]:
+                return False
+        elif (file.get(field) == value) != (operator == "="):
+            return False
+    return True
+
+
+class FakeDrive:
+    """
+    In-memory Drive v3 with the subset of API used by the app (files,
+    resumable uploads, media ranges, changes, batch). Each refresh token is
+    a separate Drive. Latency, bandwidth, random failures and per-user quota
+    are emulated, so upload and review flows can be load tested without
+    Google. Content is kept in memory of the process.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float,
+        latency_jitter_ms: float,
+        bandwidth: int,
+        error_rate: float,
+        quota_rate: float,
+        quota_burst: int
+    ):
+        self.latency = latency_ms / 1000
+        self.latency_jitter = latency_jitter_ms / 1000
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.quota_burst = quota_burst
+
+        self.files = {}
+        self.contents = {}
+        self.changes = []
+        self.uploads = {}
+        self.quotas = {}
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    # Credentials
+
+    def owner(self, refresh_token: str) -> str:
+        return hashlib.sha256(refresh_token.encode()).hexdigest()[:16]
+
+    def refresh(self, creds: Credentials):
+        # Replaces refresh of google-auth, token identifies Drive of the user
+        creds.token = f"fake.{self.owner(creds.refresh_token)}"
+        creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=TOKEN_LIFETIME_SECONDS
+        )
+
+    def authorize(self, code: str) -> Credentials:
+        # Any authorization code is accepted, it becomes the refresh token
+        web_creds = const.GoogleAPI.CREDS["web"]
+        creds = Credentials(
+            None,
+            refresh_token=f"fake-{code}",
+            token_uri=web_creds["token_uri"],
+            client_id=web_creds["client_id"],
+            client_secret=web_creds["client_secret"],
+            scopes=const.GoogleAPI.SCOPES,
+        )
+        self.refresh(creds)
+        return creds
+
+    # Emulation of network and limits
+
+    def delay(self, size: int = 0) -> float:
+        delay = self.latency + random.uniform(0, self.latency_jitter)
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        return delay
+
+    def _allow(self, owner: str) -> bool:
+        # Token bucket per user, request over quota is refused, not delayed
+        now = time.monotonic()
+        tokens, updated = self.quotas.get(owner, (self.quota_burst, now))
+        tokens = min(self.quota_burst, tokens + (now - updated) * self.quota_rate)
+        allowed = tokens >= 1
+        self.quotas[owner] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def _fault(self, owner: str) -> tuple | None:
+        self.requests += 1
+        if self.quota_rate and not self._allow(owner):
+            self.rate_limited += 1
+            return error(403, "userRateLimitExceeded", "User Rate Limit Exceeded")
+        if self.error_rate and random.random() < self.error_rate:
+            self.failed += 1
+            return error(503, "backendError", "Backend Error")
+        return None
+
+    # Requests
+
+    def handle(self, method: str, url: str, headers: dict, body: bytes) -> tuple:
+        # Returns status, headers and body of response
+        headers = {k.lower(): v for k, v in headers.items()}
+        authorization = headers.get("authorization", "")
+        if not authorization.startswith("Bearer fake."):
+            return error(401, "authError", "Invalid Credentials")
+        owner = authorization[len("Bearer fake."):]
+
+        parts = urlsplit(url)
+        params = dict(parse_qsl(parts.query))
+        with self.lock:
+            fault = self._fault(owner)
+            if fault is not None:
+                return fault
+            try:
+                return self._route(owner, method, parts.path, params, headers, body)
+            except ValueError as e:
+                return error(400, "invalid", str(e))
+
+    def _route(self, owner, method, path, params, headers, body) -> tuple:
+        if path == "/drive/v3/about" and method == "GET":
+            return ok({"user": {"emailAddress": f"{owner}@drive.fake"}})
+        if path == "/drive/v3/files" and method == "GET":
+            return self._list(owner, params)
+        if path == "/drive/v3/files" and method == "POST":
+            return ok(self._create(owner, json.loads(body or b"{}")))
+        if path.startswith("/drive/v3/files/"):
+            file_id = path[len("/drive/v3/files/"):]
+            if method == "GET":
+                return self._get(owner, file_id, params, headers)
+            if method == "DELETE":
+                return self._delete(owner, file_id)
+        if path == "/upload/drive/v3/files" and params.get("uploadType") == "resumable":
+            if method == "POST":
+                return self._upload_start(owner, headers, body)
+            if method == "PUT":
+                return self._upload_chunk(owner, params.get("upload_id"), headers, body)
+        if path == "/drive/v3/changes/startPageToken" and method == "GET":
+            return ok({"startPageToken": str(len(self.changes))})
+        if path == "/drive/v3/changes" and method == "GET":
+            return self._list_changes(owner, params)
+
+        return error(404, "notFound", f"Not Found: {method} {path}")
+
+    def _file(self, owner: str, file_id: str) -> dict | None:
+        file = self.files.get(file_id)
+        if file is None or file["owner"] != owner:
+            return None
+        return file
+
+    def _public(self, file: dict) -> dict:
+        return {k: v for k, v in file.items() if k != "owner"}
+
+    def _changed(self, owner: str, file_id: str):
+        self.changes.append((owner, file_id))
+
+    def _list(self, owner: str, params: dict) -> tuple:
+        clauses = parse_query(params.get("q", ""))
+        files = [
+            self._public(f) for f in self.files.values()
+            if f["owner"] == owner and matches(f, clauses)
+        ]
+        offset = int(params.get("pageToken", 0))
+        size = int(params.get("pageSize", 100))
+        response = {"files": files[offset:offset + size]}
+        if offset + size < len(files):
+            response["nextPageToken"] = str(offset + size)
+        return ok(response)
+
+    def _create(self, owner: str, metadata: dict, content: bytes = b"") -> dict:
+        now = datetime.datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+        file_id = uuid.uuid4().hex
+        file = {
+            "id": file_id,
+            "owner": owner,
+            "name": metadata.get("name", "Untitled"),
+            "mimeType": metadata.get("mimeType", "application/octet-stream"),
+            "parents": metadata.get("parents", []),
+            "trashed": False,
+            "size": str(len(content)),
+            "createdTime": now,
+            "modifiedTime": now
+        }
+        self.files[file_id] = file
+        self.contents[file_id] = content
+        self._changed(owner, file_id)
+        return self._public(file)
+
+    def _get(self, owner: str, file_id: str, params: dict, headers: dict) -> tuple:
+        file = self._file(owner, file_id)
+        if file is None:
+            return error(404, "notFound", f"File not found: {file_id}")
+        if params.get("alt") != "media":
+            return ok(self._public(file))
+
+        content = self.contents[file_id]
+        match = re.match(r"^bytes=(\d+)-(\d*)$", headers.get("range", ""))
+        if match is None:
+            return 200, {"content-type": file["mimeType"]}, content
+
+        start = int(match.group(1))
+        last = len(content) - 1
+        end = min(int(match.group(2)), last) if match.group(2) else last
+        if start > end:
+            # Like Drive, unsatisfiable range still reports size of file
+            status, response_headers, body = error(
+                416, "requestedRangeNotSatisfiable", "Range Not Satisfiable"
+            )
+            response_headers["content-range"] = f"bytes */{len(content)}"
+            return status, response_headers, body
+        return 206, {
+            "content-type": file["mimeType"],
+            "content-range": f"bytes {start}-{end}/{len(content)}"
+        }, content[start:end + 1]
+
+    def _delete(self, owner: str, file_id: str) -> tuple:
+        if self._file(owner, file_id) is None:
+            return error(404, "notFound", f"File not found: {file_id}")
+        del self.files[file_id]
+        del self.contents[file_id]
+        self._changed(owner, file_id)
+        return 204, {}, b""
+
+    def _upload_start(self, owner: str, headers: dict, body: bytes) -> tuple:
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {
+            "owner": owner,
+            "metadata": json.loads(body or b"{}"),
+            "size": int(headers.get("x-upload-content-length", -1)),
+            "content": bytearray()
+        }
+        location = (
+            f"{ROOT_URL}/upload/drive/v3/files"
+            f"?uploadType=resumable&upload_id={upload_id}"
+        )
+        return 200, {"location": location}, b""
+
+    def _upload_chunk(
+        self,
+        owner: str,
+        upload_id: str,
+        headers: dict,
+        body: bytes
+    ) -> tuple:
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload["owner"] != owner:
+            return error(404, "notFound", "Upload session not found")
+
+        match = re.match(
+            r"^bytes (?:(\d+)-(\d+)|\*)/(\d+)$", headers.get("content-range", "")
+        )
+        if match is None:
+            raise ValueError("Invalid Content-Range")
+        start, total = match.group(1), int(match.group(3))
+
+        content = upload["content"]
+        # Only continuation of persisted bytes is accepted
+        if start is not None and int(start) == len(content):
+            content.extend(body)
+
+        if len(content) < total:
+            headers = {"range": f"bytes=0-{len(content) - 1}"} if content else {}
+            return 308, headers, b""
+
+        del self.uploads[upload_id]
+        return ok(self._create(owner, upload["metadata"], bytes(content)))
+
+    def _list_changes(self, owner: str, params: dict) -> tuple:
+        position = int(params["pageToken"])
+        size = int(params.get("pageSize", 100))
+        changes = []
+        while position < len(self.changes) and len(changes) < size:
+            change_owner, file_id = self.changes[position]
+            position += 1
+            if change_owner != owner:
+                continue
+            file = self.files.get(file_id)
+            if file is None:
+                changes.append({"fileId": file_id, "removed": True})
+            else:
+                changes.append({
+                    "fileId": file_id, "removed": False, "file": self._public(file)
+                })
+
+        token = "nextPageToken" if position < len(self.changes) else "newStartPageToken"
+        return ok({"changes": changes, token: str(position)})
+
+    def handle_batch(self, headers: dict, body: bytes) -> tuple:
+        # Every part is separate request, as for Drive quota
+        headers = {k.lower(): v for k, v in headers.items()}
+        parser = FeedParser()
+        parser.feed(f"content-type: {headers['content-type']}\r\n\r\n")
+        parser.feed(body.decode() if isinstance(body, bytes) else body)
+        message = parser.close()
+
+        boundary = uuid.uuid4().hex
+        response = []
+        for part in message.get_payload():
+            request_line, payload = part.get_payload().split("\n", 1)
+            method, path, _ = request_line.split(" ", 2)
+            inner = FeedParser()
+            inner.feed(payload)
+            request = inner.close()
+            status, _, content = self.handle(
+                method, f"{ROOT_URL}{path}", dict(request.items()),
+                request.get_payload().encode()
+            )
+            content_id = part["Content-ID"][1:-1]
+            response.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                "Content-Type: application/json\r\n\r\n"
+                f"{content.decode()}\r\n"
+            )
+        response.append(f"--{boundary}--")
+        headers = {"content-type": f"multipart/mixed; boundary={boundary}"}
+        return 200, headers, "".join(response).encode()
+
+    def dispatch(self, method: str, url: str, headers: dict, body: bytes) -> tuple:
+        if urlsplit(url).path == "/batch/drive/v3":
+            return self.handle_batch(headers, body)
+        return self.handle(method, url, headers, body)
+
+    # Transports
+
+    def http(self) -> "FakeHttp":
+        return FakeHttp(self)
+
+    def transport(self) -> httpx.AsyncBaseTransport:
+        async def handler(request: httpx.Request) -> httpx.Response:
+            status, headers, content = self.dispatch(
+                request.method,
+                str(request.url),
+                dict(request.headers),
+                request.content
+            )
+            await asyncio.sleep(self.delay(len(request.content) + len(content)))
+            return httpx.Response(status, headers=headers, content=content)
+
+        return httpx.MockTransport(handler)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "files": len(self.files),
+                "bytes": sum(len(c) for c in self.contents.values()),
+                "uploads": len(self.uploads),
+                "requests": self.requests,
+                "failed": self.failed,
+                "rate_limited": self.rate_limited
+            }
+
+
+class FakeHttp:
+    # httplib2.Http interface for googleapiclient services
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def request(
+        self,
+        uri,
+        method="GET",
+        body=None,
+        headers=None,
+        redirections=None,
+        connection_type=None
+    ):
+        if isinstance(body, str):
+            body = body.encode()
+        body = body or b""
+        status, response_headers, content = self.drive.dispatch(
+            method, uri, headers or {}, body
+        )
+        time.sleep(self.drive.delay(len(body) + len(content)))
+
+        response = httplib2.Response({"status": status, **response_headers})
+        response.reason = HTTPStatus(status).phrase
+        return response, content
+
+
+fake_drive = FakeDrive(
+    latency_ms=const.FAKE_DRIVE.LATENCY_MS,
+    latency_jitter_ms=const.FAKE_DRIVE.LATENCY_JITTER_MS,
+    bandwidth=const.FAKE_DRIVE.BANDWIDTH,
+    error_rate=const.FAKE_DRIVE.ERROR_RATE,
+    quota_rate=const.FAKE_DRIVE.QUOTA_RATE,
+    quota_burst=const.FAKE_DRIVE.QUOTA_BURST
+) if const.GoogleAPI.BACKEND == "fake" else None
@@ -0,0 +1,188 @@
+import time
+import asyncio
+import threading
+import functools
+from typing import AsyncIterator, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import Request
+
+from api.deps import const
+
+
+CONVERT = "convert"
+CRYPTO = "crypto"
+DRIVE = "drive"
+INFERENCE = "inference"
+STORAGE = "storage"
+POLL = "poll"
+
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class Category:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+
+    def stats(self) -> dict:
+        started = self.completed + self.failed + self.running or 1
+        return {
+            "limit": self.limit,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "avg_queue_seconds": self.queue_seconds / started,
+            "max_queue_seconds": self.max_queue_seconds
+        }
+
+
+class Executors:
+    """
+    Runs blocking work from async endpoints in shared thread pool, with
+    concurrency limit per category of work. Work waiting for its turn is
+    dropped when client disconnects, running work finishes but its slot
+    is released only afterwards, so limits always hold.
+    """
+
+    def __init__(self, limits: dict):
+        self.categories = {
+            name: Category(name, limit) for name, limit in limits.items()
+        }
+        self.pool = ThreadPoolExecutor(
+            max_workers=sum(limits.values()),
+            thread_name_prefix="executor"
+        )
+
+    async def _run(self, category: Category, fn: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+
+        queued = time.perf_counter()
+        category.waiting += 1
+        try:
+            await category.semaphore.acquire()
+        except asyncio.CancelledError:
+            category.cancelled += 1
+            raise
+        finally:
+            category.waiting -= 1
+
+        waited = time.perf_counter() - queued
+        category.queue_seconds += waited
+        category.max_queue_seconds = max(category.max_queue_seconds, waited)
+        category.running += 1
+
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(category.semaphore.release)
+            except RuntimeError:
+                # Event loop already closed on shutdown
+                pass
+
+        future = self.pool.submit(functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(release)
+        try:
+            result = await asyncio.wrap_future(future)
+            category.completed += 1
+            return result
+        except asyncio.CancelledError:
+            category.cancelled += 1
+            raise
+        except Exception:
+            category.failed += 1
+            raise
+        finally:
+            category.running -= 1
+
+    async def _wait_disconnect(self, request: Request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    async def run(
+        self,
+        name: str,
+        fn: Callable,
+        *args,
+        request: Request | None = None,
+        **kwargs
+    ):
+        work = self._run(self.categories[name], fn, *args, **kwargs)
+        if request is None:
+            return await work
+
+        return await self.watch(work, request)
+
+    async def watch(self, awaitable, request: Request):
+        # Work is cancelled when client disconnects before it finishes
+        task = asyncio.ensure_future(awaitable)
+        watcher = asyncio.ensure_future(self._wait_disconnect(request))
+        try:
+            done, _ = await asyncio.wait(
+                {task, watcher}, return_when=asyncio.FIRST_COMPLETED
+            )
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            watcher.cancel()
+
+        if task not in done:
+            task.cancel()
+            raise ClientDisconnected()
+        return task.result()
+
+    async def iterate(self, name: str, iterator: Iterator) -> AsyncIterator:
+        # Pull items of blocking iterator (e.g. download stream) one by one
+        sentinel = object()
+        # Steps and close of iterator never overlap, pulling item can still
+        # run in pool thread when consumer stops
+        lock = threading.Lock()
+
+        def step():
+            with lock:
+                return next(iterator, sentinel)
+
+        def close():
+            with lock:
+                iterator.close()
+
+        try:
+            while True:
+                item = await self.run(name, step)
+                if item is sentinel:
+                    break
+                yield item
+        finally:
+            if getattr(iterator, "close", None) is not None:
+                # Closed in pool thread after running step finishes, so
+                # cleanup of generator (e.g. temporary files) always runs
+                self.pool.submit(close)
+
+    def stats(self) -> dict:
+        return {
+            name: category.stats() for name, category in self.categories.items()
+        }
+
+
+executors = Executors({
+    CONVERT: const.EXECUTOR.CONVERT_LIMIT,
+    CRYPTO: const.EXECUTOR.CRYPTO_LIMIT,
+    DRIVE: const.EXECUTOR.DRIVE_LIMIT,
+    INFERENCE: const.EXECUTOR.INFERENCE_LIMIT,
+    STORAGE: const.EXECUTOR.STORAGE_LIMIT,
+    POLL: const.EXECUTOR.POLL_LIMIT
+})
@@ -1,9 +1,15 @@
 import os
 import os.path
+import time
+import datetime
+import shutil
+import logging
 import tempfile
+import threading
 from io import BytesIO
 from pathlib import Path
 
+from azure.core.credentials import AccessToken
 from azure.identity import DefaultAzureCredential
 from azure.ai.ml import MLClient, Input
 from azure.ai.ml.entities import Data
@@ -14,79 +20,286 @@ from api.deps import const
 from api.deps.mri_file import MRIFile
 
 
+log = logging.getLogger(const.APP_NAME)
+
+# Scope of Azure Resource Manager, used by MLClient
+MANAGEMENT_SCOPE = "https://management.azure.com/.default"
+
+COMPLETED = "Completed"
+# Terminal states of jobs which produced no result
+FAILED = {"Failed", "Canceled"}
+
+
+def poll_delay(poll_count: int, notified: bool = False) -> datetime.timedelta:
+    # Delay before next status check after poll_count checks, job which
+    # called back is finishing and is checked as often as without callbacks
+    if const.AZUREML.CALLBACK_ENABLED and not notified:
+        seconds = const.AZUREML.POLL_MAX_SECONDS
+    elif poll_count == 0:
+        seconds = const.AZUREML.POLL_FIRST_SECONDS
+    else:
+        seconds = min(
+            const.AZUREML.POLL_MAX_SECONDS,
+            const.AZUREML.POLL_INTERVAL_SECONDS * 2 ** (poll_count - 1)
+        )
+    return datetime.timedelta(seconds=seconds)
+
+
+async def notify(annotation, clients: dict, failed: bool):
+    # Connected user is told that AI annotation finished or failed
+    data = {
+        "annotation_id": annotation.id,
+        "user_id": annotation.created_by,
+        "mri_id": annotation.mri_file_id,
+        "screening_id": annotation.mri_file.screening_id,
+        "failed": failed
+    }
+
+    if annotation.created_by in clients:
+        await clients[annotation.created_by].put(data)
+
+
 class InferenceAuthException(Exception):
     pass
 
 
+class CachedCredential:
+    """
+    Token cache in front of Azure credential chain. Discovery of working
+    credential and token fetch (e.g. Azure CLI process) take seconds, so
+    token is reused until it is about to expire. Within refresh margin it
+    is refreshed in background while cached one is still returned.
+    """
+
+    # Token is refreshed in foreground when it expires sooner than this
+    EXPIRY_SKEW_SECONDS = 30
+
+    def __init__(self, credential, refresh_margin_seconds: int):
+        self.credential = credential
+        self.refresh_margin = refresh_margin_seconds
+        self.tokens = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+        self.background_refreshes = 0
+
+    def _fetch(self, key: tuple, scopes: tuple, **kwargs) -> AccessToken:
+        with self.fetch_lock:
+            # Token could be fetched while waiting for lock
+            token = self.tokens.get(key)
+            if (
+                token is not None
+                and token.expires_on - time.time() > self.refresh_margin
+            ):
+                return token
+
+            token = self.credential.get_token(*scopes, **kwargs)
+            with self.lock:
+                self.tokens[key] = token
+                self.fetches += 1
+            return token
+
+    def _refresh(self, key: tuple, scopes: tuple, kwargs: dict):
+        try:
+            self._fetch(key, scopes, **kwargs)
+        except Exception:
+            log.warning(
+                "Azure token was not refreshed in background.",
+                extra={"topic": "INFERENCE"}
+            )
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def get_token(
+        self,
+        *scopes: str,
+        claims: str | None = None,
+        **kwargs
+    ) -> AccessToken:
+        if claims is not None:
+            # Claims challenge needs new token
+            return self.credential.get_token(*scopes, claims=claims, **kwargs)
+
+        key = (scopes, kwargs.get("tenant_id"))
+        with self.lock:
+            token = self.tokens.get(key)
+            if token is not None:
+                remaining = token.expires_on - time.time()
+                if remaining > self.EXPIRY_SKEW_SECONDS:
+                    self.hits += 1
+                    if (
+                        remaining < self.refresh_margin
+                        and key not in self.refreshing
+                    ):
+                        self.refreshing.add(key)
+                        self.background_refreshes += 1
+                        threading.Thread(
+                            target=self._refresh,
+                            args=(key, scopes, kwargs),
+                            daemon=True
+                        ).start()
+                    return token
+
+        return self._fetch(key, scopes, **kwargs)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "tokens": len(self.tokens),
+                "hits": self.hits,
+                "fetches": self.fetches,
+                "background_refreshes": self.background_refreshes
+            }
+
+
 class MLInference:
+    """
+    Process wide Azure ML client. It is created on first use (or warm up
+    at startup), so its credential and HTTP connections are shared by all
+    uploads and scheduler runs.
+    """
     FILE_FORMAT = ".nii.gz"
 
-    def __init__(self):
-        self.ml = MLClient(
-            DefaultAzureCredential(
-                exclude_environment_credential=True,
-                exclude_managed_identity_credential=True,
-                exclude_shared_token_cache_credential=True
-            ),
-            const.AZUREML.SUBSCRIPTION_ID,
-            const.AZUREML.RESOURCE_GROUP,
-            const.AZUREML.WORKSPACE
-        )
-        self.endpoint = const.AZUREML.ENDPOINT
+    def __init__(
+        self,
+        subscription_id: str,
+        resource_group: str,
+        workspace: str,
+        endpoint: str,
+        refresh_margin_seconds: int
+    ):
+        self.subscription_id = subscription_id
+        self.resource_group = resource_group
+        self.workspace = workspace
+        self.endpoint = endpoint
+        self.refresh_margin = refresh_margin_seconds
+        self.credential = None
+        self.client = None
+        self.lock = threading.Lock()
 
-    def launch(self, mri: BytesIO) -> str:
-        with tempfile.NamedTemporaryFile(suffix=self.FILE_FORMAT) as nifti:
-            path = Path(nifti.name)
-            nifti.write(mri.getbuffer())
+    @property
+    def ml(self) -> MLClient:
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.credential = CachedCredential(
+                        DefaultAzureCredential(
+                            exclude_environment_credential=True,
+                            exclude_managed_identity_credential=True,
+                            exclude_shared_token_cache_credential=True
+                        ),
+                        self.refresh_margin
+                    )
+                    self.client = MLClient(
+                        self.credential,
+                        self.subscription_id,
+                        self.resource_group,
+                        self.workspace
+                    )
+        return self.client
+
+    def warm_up(self):
+        # Credential discovery and first token happen before first upload
+        try:
+            self.ml
+            self.credential.get_token(MANAGEMENT_SCOPE)
+        except Exception:
+            log.warning(
+                "Azure ML client was not warmed up.",
+                extra={"topic": "INFERENCE"}
+            )
 
-            source = Data(path=path, type=AssetTypes.URI_FILE)
+    def stats(self) -> dict:
+        if self.credential is None:
+            return {"initialized": False}
+        return {"initialized": True, **self.credential.stats()}
 
-            try:
-                # Upload source NIfTI file to Azure
-                data = self.ml.data.create_or_update(source)
-                input_file = Input(type=AssetTypes.URI_FILE, path=data.id)
+    def input_name(self, annotation_id: int) -> str:
+        # Output of scoring script has name of its input
+        return f"{annotation_id}{self.FILE_FORMAT}"
 
-                # Run inference on uploaded file
-                job = self.ml.batch_endpoints.invoke(
-                    endpoint_name=self.endpoint,
-                    inputs={"file": input_file}
-                )
-            except ClientAuthenticationError:
-                raise InferenceAuthException()  # Handle exeception and log
+    def stage(self, directory: str, name: str, mri):
+        mri.seek(0)
+        with open(os.path.join(directory, name), "wb") as f:
+            shutil.copyfileobj(mri, f)
 
-            return job.name
+    def launch(self, directory: str) -> str:
+        # All staged NIfTI files are inputs of one batch job
+        source = Data(path=directory, type=AssetTypes.URI_FOLDER)
 
-    def complete(self, job_name: str) -> MRIFile | None:
         try:
-            job = self.ml.jobs.get(job_name)
+            # Upload source folder to Azure
+            data = self.ml.data.create_or_update(source)
+            input_folder = Input(type=AssetTypes.URI_FOLDER, path=data.id)
 
-            if job.status == "Completed":
-                # Download finished NIfTI of annotation into temporary directory
-                temp_directory = tempfile.TemporaryDirectory()
-                temp_dir_path = Path(temp_directory.name)
-                self.ml.jobs.download(name=job.name, download_path=temp_dir_path)
+            # Run inference on every file of uploaded folder
+            job = self.ml.batch_endpoints.invoke(
+                endpoint_name=self.endpoint,
+                inputs={"file": input_folder}
+            )
+        except ClientAuthenticationError:
+            raise InferenceAuthException()  # Handle exeception and log
+
+        return job.name
+
+    def job_status(self, job_name: str) -> str:
+        try:
+            return self.ml.jobs.get(job_name).status
+        except ClientAuthenticationError:
+            raise InferenceAuthException()
 
-                # Load NIfTI file from the directory
-                mri = self._load_result(temp_dir_path)
-                temp_directory.cleanup()
+    def cancel(self, job_name: str):
+        # Cancellation is only requested, result of operation is not awaited
+        try:
+            self.ml.jobs.begin_cancel(job_name)
+        except ClientAuthenticationError:
+            raise InferenceAuthException()
 
-                return mri
+    def download_results(self, job_name: str, inputs: list) -> dict:
+        try:
+            # Download finished NIfTI files of annotations into temporary directory
+            with tempfile.TemporaryDirectory() as temp_directory:
+                temp_dir_path = Path(temp_directory)
+                self.ml.jobs.download(name=job_name, download_path=temp_dir_path)
 
-            # elif job.status == 'Failed':
-            #    annotation.job_name = None
+                # Load NIfTI files from the directory
+                return self._load_results(temp_dir_path, inputs)
 
         except ClientAuthenticationError:
-            raise InferenceAuthException()  # Handle exeception and log
+            raise InferenceAuthException()
 
-    def _load_result(self, directory_path: str) -> MRIFile | None:
+    def _load_results(self, directory_path: str, inputs: list) -> dict:
+        # Input name -> its result, None when job has no output for it
         result_files = list(filter(
             lambda f: f.endswith(self.FILE_FORMAT),
             os.listdir(directory_path)
         ))
-        if len(result_files) == 0:
-            return None
 
-        mri_file = result_files[0]
-        with open(os.path.join(directory_path, mri_file), "rb") as f:
-            content = BytesIO(f.read())
-            return MRIFile(mri_file, content)
+        results = {}
+        for name in inputs:
+            if name is None:
+                # Job launched for single file, before inputs were named
+                mri_file = result_files[0] if len(result_files) == 1 else None
+            else:
+                mri_file = name if name in result_files else None
+
+            if mri_file is None:
+                results[name] = None
+                continue
+
+            with open(os.path.join(directory_path, mri_file), "rb") as f:
+                results[name] = MRIFile(mri_file, BytesIO(f.read()))
+
+        return results
+
+
+ml_inference = MLInference(
+    subscription_id=const.AZUREML.SUBSCRIPTION_ID,
+    resource_group=const.AZUREML.RESOURCE_GROUP,
+    workspace=const.AZUREML.WORKSPACE,
+    endpoint=const.AZUREML.ENDPOINT,
+    refresh_margin_seconds=const.AZUREML.TOKEN_REFRESH_MARGIN_SECONDS
+)
@@ -0,0 +1,174 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+import threading
+from typing import List
+
+from fastapi import UploadFile
+
+from api.deps import const
+from api.deps.utils import APIException
+
+
+ACCEPTED = "accepted"
+VALIDATING = "validating"
+CONVERTING = "converting"
+ENCRYPTING = "encrypting"
+UPLOADING = "uploading"
+INFERENCE_QUEUED = "inference_queued"
+DONE = "done"
+FAILED = "failed"
+
+log = logging.getLogger(const.APP_NAME)
+
+
+class UploadJob:
+    def __init__(self, user_id: int, screening_id: int, directory: str):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.screening_id = screening_id
+        self.directory = directory
+        self.stage = ACCEPTED
+        self.progress = None
+        self.mri_id = None
+        self.error = None
+        self.updated_at = time.time()
+
+    def info(self) -> dict:
+        return {
+            "type": "upload_job",
+            "job_id": self.id,
+            "screening_id": self.screening_id,
+            "stage": self.stage,
+            "progress": self.progress,
+            "mri_id": self.mri_id,
+            "error": self.error
+        }
+
+
+class UploadJobs:
+    """
+    Uploads accepted with 202 Accepted and processed in background of the
+    worker which received them. Stages are reported to user's event stream.
+    Encryption is streamed into upload, encrypting stage starts it and is
+    followed by uploading progress as ciphertext is sent.
+    """
+
+    def __init__(self, spool_dir: str, retention_seconds: int):
+        self.spool_dir = spool_dir
+        self.retention_seconds = retention_seconds
+        self.jobs = {}
+        self.tasks = {}
+
+    def get(self, job_id: str, user_id: int) -> UploadJob | None:
+        job = self.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _prune(self):
+        expiration = time.time() - self.retention_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.stage in (DONE, FAILED) and job.updated_at < expiration:
+                del self.jobs[job_id]
+
+    async def _spool(self, files: List[UploadFile], directory: str) -> list:
+        paths = []
+        for i, f in enumerate(files):
+            path = os.path.join(directory, f"{i:05d}")
+            await f.seek(0)
+            with open(path, "wb") as spooled:
+                while chunk := await f.read(const.UPLOAD_JOBS.SPOOL_CHUNK_SIZE):
+                    spooled.write(chunk)
+            paths.append((path, f.filename))
+        return paths
+
+    async def submit(
+        self,
+        files: List[UploadFile],
+        user_id: int,
+        screening_id: int,
+        pipeline,
+        clients: dict,
+        translation
+    ) -> UploadJob:
+        self._prune()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        directory = os.path.join(self.spool_dir, str(uuid.uuid4()))
+        os.makedirs(directory)
+
+        job = UploadJob(user_id, screening_id, directory)
+        try:
+            spooled = await self._spool(files, directory)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        self.jobs[job.id] = job
+        self.tasks[job.id] = asyncio.create_task(
+            self._run(job, spooled, pipeline, clients, translation)
+        )
+        return job
+
+    def _notify(self, job: UploadJob, clients: dict, stage: str, progress=None):
+        job.stage = stage
+        job.progress = progress
+        job.updated_at = time.time()
+        if job.user_id in clients:
+            clients[job.user_id].put_nowait(job.info())
+
+    async def _run(
+        self,
+        job: UploadJob,
+        spooled: list,
+        pipeline,
+        clients: dict,
+        translation
+    ):
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+
+        def progress(stage: str, fraction: float | None = None):
+            if threading.get_ident() == loop_thread:
+                self._notify(job, clients, stage, fraction)
+            else:
+                # Called from executor thread
+                loop.call_soon_threadsafe(
+                    self._notify, job, clients, stage, fraction
+                )
+
+        files = [
+            UploadFile(file=open(path, "rb"), filename=filename)
+            for path, filename in spooled
+        ]
+        try:
+            mri = await pipeline(files, progress)
+            job.mri_id = mri["id"]
+            self._notify(job, clients, DONE)
+
+        except APIException as e:
+            job.error = e.content.get("message")
+            self._notify(job, clients, FAILED)
+
+        except Exception:
+            log.exception(
+                f"Upload job '{job.id}' failed.",
+                extra={"topic": "UPLOAD"}
+            )
+            job.error = translation["upload_job_failed"]
+            self._notify(job, clients, FAILED)
+
+        finally:
+            for f in files:
+                f.file.close()
+            shutil.rmtree(job.directory, ignore_errors=True)
+            del self.tasks[job.id]
+
+
+upload_jobs = UploadJobs(
+    spool_dir=const.UPLOAD_JOBS.SPOOL_DIR,
+    retention_seconds=const.UPLOAD_JOBS.RETENTION_SECONDS
+)
@@ -1,90 +1,152 @@
+import os
+import shutil
 import tempfile
+import functools
 from io import BytesIO
-from gzip import compress
+from gzip import GzipFile
 from pathlib import Path
-from typing import List
+from typing import Callable, Iterator, List
 
 from fastapi import UploadFile
-from googleapiclient.http import MediaIoBaseUpload
-from buffered_encryption.aesctr import (
-    EncryptionIterator, ReadOnlyEncryptedFile
-)
+from buffered_encryption.aesctr import ReadOnlyEncryptedFile
 
-from pydicom import dcmread
+from pydicom import config as dicom_config, dcmread
 from pydicom.errors import InvalidDicomError
-import dicom2nifti
-from dicom2nifti.exceptions import ConversionValidationError
+from pydicom.uid import UncompressedTransferSyntaxes
 from nibabel import FileHolder, Nifti1Image
 from nibabel.spatialimages import HeaderDataError
 from nibabel.wrapstruct import WrapStructError
 
 from api.deps import const
+from api.deps import storage
+from api.deps.cache import drive_cache
+from api.deps.compression import is_gzip, parallel_gzip
+from api.deps.conversion import ConversionPool
+from api.deps.crypto import EncryptedReader, ctr_cipher
+
+
+conversion_pool = ConversionPool(const.DICOM.CONVERSION_WORKERS)
+
+
+def place_file(content, path: Path):
+    # Files spooled by upload job are hard linked into scratch directory.
+    # Request uploads are anonymous temporary files, those are copied once,
+    # by kernel when they already rolled over to disk.
+    name = getattr(content, "name", None)
+    if isinstance(name, str) and os.path.isabs(name):
+        try:
+            os.link(name, path)
+            return
+        except OSError:
+            # Scratch directory is on other filesystem than spool
+            pass
+
+    content.seek(0)
+    with open(path, "wb") as f:
+        raw = getattr(content, "_file", content)
+        try:
+            source = raw.fileno()
+        except (AttributeError, OSError, ValueError):
+            # Upload is still in memory
+            shutil.copyfileobj(content, f)
+            return
+
+        raw.flush()
+        offset = 0
+        while sent := os.sendfile(f.fileno(), source, offset, 1 << 30):
+            offset += sent
+
+
+@functools.lru_cache
+def is_decodable(transfer_syntax: str | None) -> bool:
+    # Conversion reads pixel data by pydicom, compressed syntaxes need one
+    # of its optional handlers (e.g. GDCM, pylibjpeg) installed
+    if transfer_syntax is None or transfer_syntax in UncompressedTransferSyntaxes:
+        return True
+    return any(
+        handler.supports_transfer_syntax(transfer_syntax) and handler.is_available()
+        for handler in dicom_config.pixel_data_handlers
+    )
 
 
 class MRIFile:
     def __init__(self, filename: str, content: UploadFile | None = None):
         self.filename = filename
         self.content = content
+        self.dicom_header = None
+        self.series_uid = None
 
-    def is_nifti(self) -> bool:
+    def close(self):
+        # Converted DICOM series is open file, it is not left for GC
+        if self.content is not None:
+            self.content.close()
+
+    def is_nifti(self, compressed: bool = False) -> bool:
         try:
-            fh = FileHolder(fileobj=self.content)
+            fileobj = GzipFile(fileobj=self.content) if compressed else self.content
+            fh = FileHolder(fileobj=fileobj)
             Nifti1Image.from_file_map({"header": fh, "image": fh})
             return True
-        except (HeaderDataError, WrapStructError):
-            # Invalid header data or wrong block size
+        except (HeaderDataError, WrapStructError, OSError, EOFError):
+            # Invalid header data, wrong block size or corrupted gzip
             return False
 
     def is_dicom(self) -> bool:
+        return self.read_dicom_header() is not None
+
+    def read_dicom_header(self) -> dict | None:
+        # Parse preamble and header only, pixel data is left for conversion
+        self.content.seek(0)
         try:
-            dcmread(self.content)
-            return True
+            ds = dcmread(
+                self.content,
+                stop_before_pixels=True,
+                defer_size=const.DICOM.DEFER_SIZE
+            )
         except InvalidDicomError:
-            return False
+            return None
+
+        # Unsupported transfer syntax is rejected before conversion
+        transfer_syntax = ds.file_meta.get("TransferSyntaxUID")
+        self.dicom_header = {
+            "series_uid": str(ds.get("SeriesInstanceUID", "")) or None,
+            "transfer_syntax": str(transfer_syntax) if transfer_syntax else None
+        }
+        return self.dicom_header
 
     def from_nifti(self) -> bool:
-        if not self.is_nifti():
+        self.content.seek(0)
+        compressed = is_gzip(self.content)
+        if not self.is_nifti(compressed):
             return False
 
         self.content.seek(0)
-        self.content = BytesIO(compress(self.content.read()))
+        if not compressed:
+            self.content = parallel_gzip(self.content)
+        # Already compressed .nii.gz is stored as uploaded
         return True
 
     def from_dicom(self, dicom_files: List["MRIFile"]) -> bool:
-        temp_directory = tempfile.TemporaryDirectory()
-        temp_dir_path = Path(temp_directory.name)
-
-        for dicom_file in dicom_files:
-            dicom_file.content.seek(0)
-            temp_bytes = temp_dir_path / dicom_file.filename
-            temp_bytes.write_bytes(dicom_file.content.read())
-
-        with tempfile.NamedTemporaryFile(suffix=".nii.gz") as temp_file:
-            try:
-                dicom2nifti.dicom_series_to_nifti(
-                    temp_dir_path, Path(temp_file.name), reorient_nifti=True
-                )
-            except ConversionValidationError:
-                # Not enough slices (<4) or inconsistent slice increment
+        with tempfile.TemporaryDirectory(dir=const.DICOM.SCRATCH_DIR) as scratch:
+            scratch_path = Path(scratch)
+            series_path = scratch_path / "series"
+            series_path.mkdir()
+
+            for i, dicom_file in enumerate(dicom_files):
+                place_file(dicom_file.content, series_path / f"{i:05d}.dcm")
+
+            output_path = scratch_path / "result.nii.gz"
+            if not conversion_pool.convert(str(series_path), str(output_path)):
                 return False
 
-            temp_file.seek(0)
-            self.content = BytesIO(temp_file.read())
+            # Open handle stays valid after scratch directory is removed
+            self.content = open(output_path, "rb")
 
-        temp_directory.cleanup()
         return True
 
-    def encrypt(self) -> BytesIO:
-        enc_file = EncryptionIterator(
-            self.content,
-            const.ENC.KEY,
-            const.ENC.SIG
-        )
-
-        cipher_file = BytesIO()
-        for chunk in enc_file:
-            cipher_file.write(chunk)
-        return cipher_file
+    def encrypt(self) -> EncryptedReader:
+        # Ciphertext is produced chunk by chunk as upload reads it
+        return EncryptedReader(self.content)
 
     def decrypt(self) -> BytesIO:
         with BytesIO(self.content) as file_media_bytes:
@@ -96,30 +158,90 @@ class MRIFile:
             )
             return ef.read()
 
-    def upload_encrypted(self, service, folder_id) -> dict:
-        file_metadata = {
-            "name": self.filename,
-            "parents": [folder_id]
-        }
-        media = MediaIoBaseUpload(
-            self.encrypt(),
-            mimetype="application/octet-stream",
-            resumable=True
-        )
-        uploaded_file = service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields="id,name,createdTime"
-        ).execute()
-
-        return {
-            "id": uploaded_file.get("id"),
-            "name": uploaded_file.get("name"),
-            "created_at": uploaded_file.get("createdTime"),
-            "modified_at": uploaded_file.get("createdTime"),
-            "content": self.content
-        }
+    def download_decrypted(self, backend, file_id: str):
+        self.content = b"".join(self.download_decrypted_stream(backend, file_id))
 
-    def download_decrypted(self, service, file_id: str):
-        self.content = service.files().get_media(fileId=file_id).execute()
-        self.content = self.decrypt()
+    async def store(self, backend, progress: Callable | None = None) -> dict:
+        # Ciphertext is uploaded into given storage as it is produced
+        if progress is not None:
+            progress("encrypting")
+        uploaded_file = await backend.upload(
+            self.filename, self.encrypt(), progress
+        )
+        uploaded_file["content"] = self.content
+        return uploaded_file
+
+    def download_size(self, backend, file_id: str) -> int:
+        # Ciphertext has the same size as plaintext (AES-CTR)
+        size = drive_cache.size(file_id)
+        if size is not None:
+            return size
+        return backend.size(storage.parse_key(file_id)[1])
+
+    def download_decrypted_stream(
+        self,
+        backend,
+        file_id: str,
+        start: int = 0,
+        end: int | None = None
+    ) -> Iterator[bytes]:
+        cached = drive_cache.open(file_id)
+        if cached is not None:
+            yield from self.cached_decrypted_stream(cached, start, end)
+        else:
+            yield from self.stored_decrypted_stream(backend, file_id, start, end)
+
+    def cached_decrypted_stream(
+        self,
+        cached,
+        start: int = 0,
+        end: int | None = None
+    ) -> Iterator[bytes]:
+        # Open handle of cached file stays readable when it is evicted
+        with cached:
+            yield from self._decrypt_file(cached, start, end)
+
+    def stored_decrypted_stream(
+        self,
+        backend,
+        file_id: str,
+        start: int = 0,
+        end: int | None = None
+    ) -> Iterator[bytes]:
+        # CTR decryption is the same keystream XOR as encryption, it can
+        # start at any offset without decrypting preceding bytes
+        cipher = ctr_cipher(start)
+
+        # Only complete downloads are stored into cache
+        writer = None
+        if start == 0 and end is None and backend.cached:
+            writer = drive_cache.writer(file_id)
+        try:
+            object_id = storage.parse_key(file_id)[1]
+            for chunk in backend.get(object_id, start, end):
+                if writer is not None:
+                    writer.write(chunk)
+                yield cipher.update(chunk)
+        except BaseException:
+            if writer is not None:
+                writer.discard()
+            raise
+
+        if writer is not None:
+            writer.commit()
+
+    def _decrypt_file(self, f, start: int, end: int | None) -> Iterator[bytes]:
+        cipher = ctr_cipher(start)
+        f.seek(start)
+        remaining = -1 if end is None else end + 1 - start
+
+        while remaining != 0:
+            size = const.GoogleAPI.DOWNLOAD_CHUNK_SIZE
+            if remaining > 0:
+                size = min(size, remaining)
+                remaining -= size
+
+            chunk = f.read(size)
+            if not chunk:
+                break
+            yield cipher.update(chunk)
@@ -0,0 +1,204 @@
+import time
+import asyncio
+import logging
+import datetime
+import threading
+
+from api.db import crud
+from api.deps import const, upload
+from api.deps.executor import executors, INFERENCE, POLL
+from api.deps.inference import ml_inference, notify, COMPLETED, FAILED
+
+
+log = logging.getLogger(const.APP_NAME)
+
+
+class InferenceResults:
+    """
+    Post-processing of finished inference jobs. Results are downloaded,
+    stored and announced by few workers in background, so slow uploads
+    don't hold status checks of other jobs. Job stays pending while its
+    results are processed, scheduler doesn't submit it twice meanwhile.
+    Jobs announced by callback are awaited until Azure finalizes them,
+    every worker of the job calls back and extends the wait.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queue = None
+        self.tasks = []
+        self.waiting = set()
+        self.pending = set()
+        # Job name -> deadline of its wait, jobs which called back
+        self.deadlines = {}
+        self.notified = set()
+        self.lock = threading.Lock()
+
+        self.completed = 0
+        self.failed = 0
+        self.callbacks = 0
+
+    def _start(self):
+        # Queue is bound to event loop, which doesn't exist on import
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.tasks = [
+                asyncio.create_task(self._work()) for _ in range(self.workers)
+            ]
+
+    def is_pending(self, job_name: str) -> bool:
+        return job_name in self.pending
+
+    def is_notified(self, job_name: str) -> bool:
+        return job_name in self.notified
+
+    def submit(
+        self,
+        job_name: str,
+        annotations: list,
+        clients: dict,
+        wait: bool = False
+    ):
+        deadline = time.monotonic() + const.AZUREML.CALLBACK_WAIT_SECONDS
+        if wait:
+            self.notified.add(job_name)
+            with self.lock:
+                self.callbacks += 1
+
+        # Annotations of MRIs submitted together share one job
+        if job_name in self.pending:
+            if wait and job_name in self.deadlines:
+                # Another worker finished, job is still running
+                self.deadlines[job_name] = deadline
+            return
+        self._start()
+        self.pending.add(job_name)
+        if not wait:
+            self.queue.put_nowait((job_name, annotations, clients))
+            return
+
+        self.deadlines[job_name] = deadline
+        task = asyncio.create_task(self._wait(job_name, annotations, clients))
+        self.waiting.add(task)
+        task.add_done_callback(self.waiting.discard)
+
+    async def _wait(self, job_name: str, annotations: list, clients: dict):
+        # Scoring script calls back before job is finalized in Azure,
+        # deadline is extended by callbacks of other workers
+        try:
+            while True:
+                status = await executors.run(
+                    POLL, ml_inference.job_status, job_name
+                )
+                if status == COMPLETED:
+                    self.queue.put_nowait((job_name, annotations, clients))
+                    return
+                if status in FAILED or time.monotonic() > self.deadlines[job_name]:
+                    break
+                await asyncio.sleep(const.AZUREML.CALLBACK_POLL_SECONDS)
+        except Exception:
+            log.warning(
+                f"Status of inference job '{job_name}' was not checked.",
+                extra={"topic": "INFERENCE"}
+            )
+        finally:
+            del self.deadlines[job_name]
+
+        # Scheduler handles the job on its next run, finishing job is
+        # checked at regular interval, not at safety net one
+        self.pending.discard(job_name)
+        next_poll_at = datetime.datetime.now() + datetime.timedelta(
+            seconds=const.AZUREML.POLL_INTERVAL_SECONDS
+        )
+        await crud.reschedule_inferences({
+            annotation.id: (next_poll_at, annotation.poll_count)
+            for annotation in annotations
+        })
+
+    async def _work(self):
+        while True:
+            job_name, annotations, clients = await self.queue.get()
+            try:
+                await self._process(job_name, annotations, clients)
+            except Exception:
+                # Job names stay set, next status check submits them again
+                with self.lock:
+                    self.failed += len(annotations)
+                log.exception(
+                    f"Results of inference job '{job_name}' were not downloaded.",
+                    extra={"topic": "INFERENCE"}
+                )
+            finally:
+                self.pending.discard(job_name)
+                self.notified.discard(job_name)
+                self.queue.task_done()
+
+    async def _process(self, job_name: str, annotations: list, clients: dict):
+        # Outputs of whole job are downloaded once, each is stored separately
+        results = await executors.run(
+            INFERENCE,
+            ml_inference.download_results,
+            job_name,
+            [annotation.job_input for annotation in annotations]
+        )
+
+        for annotation in annotations:
+            mri = results.get(annotation.job_input)
+            if mri is None:
+                await self.fail(annotation, "produced no result", clients)
+                continue
+            try:
+                await self._store(annotation, mri, clients)
+                with self.lock:
+                    self.completed += 1
+            except Exception:
+                # Job name of this annotation stays set, it is retried
+                with self.lock:
+                    self.failed += 1
+                log.exception(
+                    f"Result of inference job '{job_name}' for annotation "
+                    f"{annotation.id} was not stored.",
+                    extra={"topic": "INFERENCE"}
+                )
+
+    async def _store(self, annotation, mri, clients: dict):
+        uploaded_file = await upload.storage_upload(
+            mri,
+            annotation.created_by,
+            annotation.creator.refresh_token,
+            annotation.creator.drive_folder_id
+        )
+
+        await crud.update_annotation_uploaded_file(
+            id=annotation.id,
+            filename=uploaded_file["name"],
+            file_id=uploaded_file["id"],
+            job_name=None       # Mark job as finished
+        )
+
+        await notify(annotation, clients, failed=False)
+
+    async def fail(self, annotation, reason: str, clients: dict):
+        self.notified.discard(annotation.job_name)
+        await crud.fail_inference(annotation.id)
+        log.warning(
+            f"Inference job '{annotation.job_name}' {reason}, annotation "
+            f"{annotation.id} marked failed.",
+            extra={"topic": "INFERENCE"}
+        )
+        await notify(annotation, clients, failed=True)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queue.qsize() if self.queue is not None else 0,
+                "waiting": len(self.waiting),
+                "pending": len(self.pending),
+                "completed": self.completed,
+                "failed": self.failed,
+                "callbacks": self.callbacks
+            }
+
+
+inference_results = InferenceResults(workers=const.AZUREML.RESULT_WORKERS)
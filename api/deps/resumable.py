@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import uuid
+import shutil
+from datetime import datetime
+from typing import AsyncIterator, List
+
+from fastapi import UploadFile
+
+from api.deps import const
+
+
+META_FILE = "session.json"
+FINALIZE_LOCK = "finalizing"
+
+
+class UploadSession:
+    def __init__(self, directory: str, meta: dict):
+        self.directory = directory
+        self.id = meta["session_id"]
+        self.user_id = meta["user_id"]
+        self.screening_id = meta["screening_id"]
+        self.series_uid = meta["series_uid"]
+        self.files = meta["files"]
+        self.created_at = meta["created_at"]
+
+    def data_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"{index:05d}")
+
+    def ranges(self, index: int) -> list:
+        # Received chunks are appended as "start end" lines, merged on read
+        try:
+            with open(self.data_path(index) + ".ranges", "r") as f:
+                chunks = sorted(
+                    tuple(map(int, line.split())) for line in f if line.strip()
+                )
+        except FileNotFoundError:
+            return []
+
+        merged = []
+        for start, end in chunks:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    def file_status(self, index: int) -> dict:
+        ranges = self.ranges(index)
+        size = self.files[index]["size"]
+        received = sum(end - start + 1 for start, end in ranges)
+        return {
+            "index": index,
+            "name": self.files[index]["name"],
+            "size": size,
+            "received": received,
+            "ranges": ranges,
+            "complete": received == size
+        }
+
+    def info(self) -> dict:
+        files = [self.file_status(i) for i in range(len(self.files))]
+        return {
+            "session_id": self.id,
+            "screening_id": self.screening_id,
+            "series_uid": self.series_uid,
+            "files": files,
+            "complete": all(f["complete"] for f in files),
+            "expires_at": datetime.fromtimestamp(
+                os.stat(self.directory).st_mtime
+                + const.UPLOAD_SESSIONS.RETENTION_SECONDS
+            )
+        }
+
+    def complete(self) -> bool:
+        return all(
+            self.file_status(i)["complete"] for i in range(len(self.files))
+        )
+
+    async def write(
+        self,
+        index: int,
+        start: int,
+        end: int,
+        chunks: AsyncIterator[bytes]
+    ) -> bool:
+        # Chunks of one file can arrive in parallel, each writes its own range
+        expected = end - start + 1
+        written = 0
+        fd = os.open(self.data_path(index), os.O_WRONLY)
+        try:
+            async for chunk in chunks:
+                if written + len(chunk) > expected:
+                    return False
+                os.pwrite(fd, chunk, start + written)
+                written += len(chunk)
+        finally:
+            os.close(fd)
+
+        if written != expected:
+            return False
+
+        with open(self.data_path(index) + ".ranges", "a") as f:
+            f.write(f"{start} {end}\n")
+        # Activity extends expiration of session
+        os.utime(self.directory)
+        return True
+
+    def lock(self) -> bool:
+        # Only one worker may finalize the session
+        try:
+            fd = os.open(
+                os.path.join(self.directory, FINALIZE_LOCK),
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY
+            )
+        except FileExistsError:
+            return False
+        os.close(fd)
+        return True
+
+    def unlock(self):
+        try:
+            os.unlink(os.path.join(self.directory, FINALIZE_LOCK))
+        except FileNotFoundError:
+            pass
+
+    def open_files(self) -> List[UploadFile]:
+        return [
+            UploadFile(file=open(self.data_path(i), "rb"), filename=f["name"])
+            for i, f in enumerate(self.files)
+        ]
+
+
+class UploadSessions:
+    """
+    Resumable uploads of DICOM series. Client declares files and their sizes,
+    sends chunks by offset (in any order, in parallel) and finalizes session
+    into usual MRI upload. State is kept on disk, so any worker can serve it.
+    """
+
+    def __init__(self, directory: str, retention_seconds: int):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+
+    def _prune(self):
+        expiration = time.time() - self.retention_seconds
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+
+        for entry in entries:
+            try:
+                expired = entry.stat().st_mtime < expiration
+            except FileNotFoundError:
+                continue
+            if expired:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def create(
+        self,
+        user_id: int,
+        screening_id: int,
+        series_uid: str | None,
+        files: List[dict]
+    ) -> UploadSession:
+        self._prune()
+        session_id = str(uuid.uuid4())
+        directory = os.path.join(self.directory, session_id)
+        os.makedirs(directory)
+
+        meta = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "screening_id": screening_id,
+            "series_uid": series_uid,
+            "files": files,
+            "created_at": time.time()
+        }
+        session = UploadSession(directory, meta)
+        for i, f in enumerate(files):
+            with open(session.data_path(i), "wb") as data:
+                data.truncate(f["size"])
+
+        # Metadata written last, session is visible only when prepared
+        temp_path = os.path.join(directory, f".{META_FILE}")
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(directory, META_FILE))
+        return session
+
+    def get(self, session_id: str, user_id: int) -> UploadSession | None:
+        directory = os.path.join(self.directory, os.path.basename(session_id))
+        try:
+            with open(os.path.join(directory, META_FILE), "r") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if meta["user_id"] != user_id:
+            return None
+        return UploadSession(directory, meta)
+
+    def remove(self, session: UploadSession):
+        shutil.rmtree(session.directory, ignore_errors=True)
+
+
+upload_sessions = UploadSessions(
+    directory=const.UPLOAD_SESSIONS.DIR,
+    retention_seconds=const.UPLOAD_SESSIONS.RETENTION_SECONDS
+)
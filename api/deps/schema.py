@@ -62,6 +62,7 @@ class Annotation(BaseModel):
     name: str
     is_ai: bool
     ready: bool
+    failed: bool
 
     class Config:
         orm_mode = True
@@ -88,6 +89,43 @@ class PatientFiles(BaseModel):
     mri_files: List[MRIFile]
 
 
+class UploadJob(BaseModel):
+    type: str
+    job_id: str
+    screening_id: int
+    stage: str
+    progress: float | None
+    mri_id: int | None
+    error: str | None
+
+
+class UploadSessionFile(BaseModel):
+    name: str
+    size: int = Field(..., ge=0)
+
+
+class UploadSessionCreate(BaseModel):
+    screening_id: int
+    series_uid: str | None
+    files: List[UploadSessionFile]
+
+
+class UploadSessionFileStatus(UploadSessionFile):
+    index: int
+    received: int
+    ranges: List[List[int]]
+    complete: bool
+
+
+class UploadSession(BaseModel):
+    session_id: str
+    screening_id: int
+    series_uid: str | None
+    files: List[UploadSessionFileStatus]
+    complete: bool
+    expires_at: datetime
+
+
 class ScreeningFiles(BaseModel):
     mri_files: List[MRIFileAnnotations]
 
@@ -139,3 +177,7 @@ class ExistingSeries(BaseModel):
 class ExistingStudies(BaseModel):
     study_uid: str | None
     mri_files: List[ExistingSeries]
+
+
+class InferenceCallback(BaseModel):
+    job_name: str
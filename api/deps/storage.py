@@ -0,0 +1,463 @@
+import os
+import uuid
+import tempfile
+import datetime
+from io import BytesIO
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator, List
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.http import MediaIoBaseDownload
+
+from api.deps import const
+from api.deps import drive
+from api.deps import executor
+from api.deps.drive_async import drive_client
+
+
+DRIVE = "drive"
+LOCAL = "local"
+S3 = "s3"
+
+
+def make_key(backend: str, object_id: str) -> str:
+    # Drive keys stay unqualified, so rows stored before backends existed
+    # keep pointing to Drive
+    if backend == DRIVE:
+        return object_id
+    return f"{backend}:{object_id}"
+
+
+def parse_key(file_id: str) -> tuple:
+    # Drive file IDs never contain colon
+    backend, separator, object_id = file_id.partition(":")
+    if not separator:
+        return DRIVE, file_id
+    return backend, object_id
+
+
+def is_drive(file_id: str) -> bool:
+    return parse_key(file_id)[0] == DRIVE
+
+
+class Unauthorized(Exception):
+    # Backend needs credentials of the user, who has not authorized it
+    pass
+
+
+def timestamp() -> str:
+    # Same format as createdTime of Drive
+    return datetime.datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+
+
+class BlobStorage(ABC):
+    """
+    Storage of encrypted files. Content is stored and returned as
+    ciphertext, encryption stays in MRIFile. Methods other than upload are
+    blocking, callers run them in executor of the backend's category.
+    """
+    name = None
+    category = executor.STORAGE
+    # Whether downloads are worth keeping in local cache
+    cached = True
+
+    @abstractmethod
+    async def upload(
+        self,
+        name: str,
+        reader,
+        progress: Callable | None = None
+    ) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def size(self, object_id: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(
+        self,
+        object_id: str,
+        start: int = 0,
+        end: int | None = None
+    ) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, object_ids: List[str]) -> dict:
+        # Returns errors of objects which were not deleted
+        raise NotImplementedError
+
+
+class MediaIoBaseRangeDownload(MediaIoBaseDownload):
+    # Chunked media download limited to byte range <start, end>
+    def __init__(self, fd, request, start=0, end=None, chunksize=None):
+        super().__init__(fd, request, chunksize=chunksize)
+        self._progress = start
+        self._end = end
+        self._chunk_limit = chunksize
+
+    def next_chunk(self, num_retries=0):
+        if self._end is not None:
+            self._chunksize = min(self._chunk_limit, self._end + 1 - self._progress)
+
+        status, done = super().next_chunk(num_retries=num_retries)
+        if self._end is not None and self._progress > self._end:
+            done = True
+        return status, done
+
+
+class DriveStorage(BlobStorage):
+    """
+    NeurAI folder in Google Drive of the user. Unlike other backends it is
+    bound to user's credentials, without them (Drive not authorized) every
+    request raises Unauthorized. Errors of Drive are raised as HttpError.
+    """
+    name = DRIVE
+    category = executor.DRIVE
+
+    def __init__(
+        self,
+        creds: Credentials | None = None,
+        folder_id: str | None = None
+    ):
+        self.creds = creds
+        self.folder_id = folder_id
+
+    def _service(self):
+        # Service is not thread safe, each request builds its own
+        if self.creds is None:
+            raise Unauthorized("Google Drive is not authorized")
+        return drive.service(self.creds)
+
+    async def upload(
+        self,
+        name: str,
+        reader,
+        progress: Callable | None = None
+    ) -> dict:
+        if self.creds is None:
+            raise Unauthorized("Google Drive is not authorized")
+
+        uploaded_file = await drive_client.upload_resumable(
+            self.creds,
+            {"name": name, "parents": [self.folder_id]},
+            reader,
+            progress=progress
+        )
+        return {
+            "id": uploaded_file.get("id"),
+            "name": uploaded_file.get("name"),
+            "created_at": uploaded_file.get("createdTime"),
+            "modified_at": uploaded_file.get("createdTime")
+        }
+
+    def size(self, object_id: str) -> int:
+        metadata = self._service().files().get(
+            fileId=object_id, fields="size"
+        ).execute(num_retries=const.DRIVE_THROTTLE.MAX_RETRIES)
+        return int(metadata["size"])
+
+    def get(
+        self,
+        object_id: str,
+        start: int = 0,
+        end: int | None = None
+    ) -> Iterator[bytes]:
+        request = self._service().files().get_media(fileId=object_id)
+        buffer = BytesIO()
+        downloader = MediaIoBaseRangeDownload(
+            buffer,
+            request,
+            start=start,
+            end=end,
+            chunksize=const.GoogleAPI.DOWNLOAD_CHUNK_SIZE
+        )
+
+        done = False
+        while not done:
+            _, done = downloader.next_chunk(
+                num_retries=const.DRIVE_THROTTLE.MAX_RETRIES
+            )
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def delete(self, object_ids: List[str]) -> dict:
+        # Deleted in batches, failed item is represented by its HttpError
+        service = self._service()
+        requests = [
+            service.files().delete(fileId=object_id) for object_id in object_ids
+        ]
+        results = drive.execute_batch(service, requests)
+        return {
+            object_id: result
+            for object_id, result in zip(object_ids, results)
+            if isinstance(result, Exception)
+        }
+
+
+class ObjectStorage(BlobStorage):
+    """
+    Storage of objects by generated id outside of Drive, shared by all
+    users. Missing object raises FileNotFoundError.
+    """
+
+    @abstractmethod
+    def put(self, object_id: str, reader, progress: Callable | None = None):
+        raise NotImplementedError
+
+    async def upload(
+        self,
+        name: str,
+        reader,
+        progress: Callable | None = None
+    ) -> dict:
+        object_id = uuid.uuid4().hex
+        await executor.executors.run(
+            self.category, self.put, object_id, reader, progress
+        )
+        created_at = timestamp()
+        return {
+            "id": make_key(self.name, object_id),
+            "name": name,
+            "created_at": created_at,
+            "modified_at": created_at
+        }
+
+
+def read_chunks(reader, progress: Callable | None = None) -> Iterator[bytes]:
+    size = reader.seek(0, os.SEEK_END) or 1
+    reader.seek(0)
+    while True:
+        chunk = reader.read(const.GoogleAPI.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+        if progress is not None:
+            progress("uploading", reader.tell() / size)
+
+
+class LocalStorage(ObjectStorage):
+    name = LOCAL
+    # Reading local file is as fast as reading cached one
+    cached = False
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, object_id: str) -> str:
+        # Objects are spread into subdirectories by prefix of id
+        object_id = os.path.basename(object_id)
+        return os.path.join(self.directory, object_id[:2], object_id)
+
+    def put(self, object_id: str, reader, progress: Callable | None = None):
+        path = self.path(object_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in read_chunks(reader, progress):
+                    f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def size(self, object_id: str) -> int:
+        return os.path.getsize(self.path(object_id))
+
+    def get(
+        self,
+        object_id: str,
+        start: int = 0,
+        end: int | None = None
+    ) -> Iterator[bytes]:
+        with open(self.path(object_id), "rb") as f:
+            f.seek(start)
+            remaining = -1 if end is None else end + 1 - start
+            while remaining != 0:
+                size = const.GoogleAPI.DOWNLOAD_CHUNK_SIZE
+                if remaining > 0:
+                    size = min(size, remaining)
+                    remaining -= size
+
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete(self, object_ids: List[str]) -> dict:
+        errors = {}
+        for object_id in object_ids:
+            try:
+                os.unlink(self.path(object_id))
+            except FileNotFoundError:
+                # Already deleted, same as in S3
+                pass
+            except OSError as e:
+                errors[object_id] = e
+        return errors
+
+
+class S3Storage(ObjectStorage):
+    name = S3
+    # Maximum number of keys in one DeleteObjects request
+    DELETE_LIMIT = 1000
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str,
+        endpoint_url: str | None,
+        region: str | None,
+        access_key_id: str | None,
+        secret_access_key: str | None
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.client = None
+
+    def _get_client(self):
+        # boto3 is needed only by deployments storing files in S3,
+        # its client is thread safe
+        if self.client is None:
+            import boto3
+            from botocore.config import Config
+
+            self.client = boto3.client(
+                "s3",
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                aws_access_key_id=self.access_key_id,
+                aws_secret_access_key=self.secret_access_key,
+                config=Config(
+                    retries={"max_attempts": const.DRIVE_THROTTLE.MAX_RETRIES},
+                    max_pool_connections=const.EXECUTOR.STORAGE_LIMIT
+                )
+            )
+        return self.client
+
+    def key(self, object_id: str) -> str:
+        return f"{self.prefix}{object_id}"
+
+    def _raise_client_error(self, e, object_id: str):
+        code = e.response.get("Error", {}).get("Code")
+        if code in ("404", "NoSuchKey", "NotFound"):
+            raise FileNotFoundError(object_id) from e
+        raise e
+
+    def put(self, object_id: str, reader, progress: Callable | None = None):
+        from boto3.s3.transfer import TransferConfig
+
+        size = reader.seek(0, os.SEEK_END) or 1
+        reader.seek(0)
+        uploaded = 0
+
+        def callback(sent: int):
+            nonlocal uploaded
+            uploaded += sent
+            if progress is not None:
+                progress("uploading", uploaded / size)
+
+        # Multipart upload above chunk size, parts are sent in parallel
+        self._get_client().upload_fileobj(
+            reader,
+            self.bucket,
+            self.key(object_id),
+            Callback=callback,
+            Config=TransferConfig(
+                multipart_threshold=const.GoogleAPI.UPLOAD_CHUNK_SIZE,
+                multipart_chunksize=const.GoogleAPI.UPLOAD_CHUNK_SIZE
+            )
+        )
+
+    def size(self, object_id: str) -> int:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self._get_client().head_object(
+                Bucket=self.bucket, Key=self.key(object_id)
+            )
+        except ClientError as e:
+            self._raise_client_error(e, object_id)
+        return response["ContentLength"]
+
+    def get(
+        self,
+        object_id: str,
+        start: int = 0,
+        end: int | None = None
+    ) -> Iterator[bytes]:
+        from botocore.exceptions import ClientError
+
+        kwargs = {}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = self._get_client().get_object(
+                Bucket=self.bucket, Key=self.key(object_id), **kwargs
+            )
+        except ClientError as e:
+            self._raise_client_error(e, object_id)
+
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(const.GoogleAPI.DOWNLOAD_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def delete(self, object_ids: List[str]) -> dict:
+        # S3 deletes missing keys without error
+        errors = {}
+        for offset in range(0, len(object_ids), self.DELETE_LIMIT):
+            batch = object_ids[offset:offset + self.DELETE_LIMIT]
+            response = self._get_client().delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": self.key(i)} for i in batch],
+                    "Quiet": True
+                }
+            )
+            for error in response.get("Errors", []):
+                object_id = error["Key"][len(self.prefix):]
+                errors[object_id] = OSError(error.get("Message", error["Code"]))
+        return errors
+
+
+backends = {
+    LOCAL: LocalStorage(directory=const.STORAGE.LOCAL_DIR),
+    S3: S3Storage(
+        bucket=const.STORAGE.S3_BUCKET,
+        prefix=const.STORAGE.S3_PREFIX,
+        endpoint_url=const.STORAGE.S3_ENDPOINT_URL,
+        region=const.STORAGE.S3_REGION,
+        access_key_id=const.STORAGE.S3_ACCESS_KEY_ID,
+        secret_access_key=const.STORAGE.S3_SECRET_ACCESS_KEY
+    )
+}
+
+
+def backend(name: str, creds: Credentials | None = None) -> BlobStorage:
+    # Drive needs credentials of the user whose files are accessed
+    if name == DRIVE:
+        return DriveStorage(creds)
+    return backends[name]
+
+
+def backend_for(file_id: str, creds: Credentials | None = None) -> BlobStorage:
+    return backend(parse_key(file_id)[0], creds)
+
+
+def default_backend(
+    creds: Credentials | None = None,
+    folder_id: str | None = None
+) -> BlobStorage:
+    # New files are stored into backend of deployment
+    if const.STORAGE.BACKEND == DRIVE:
+        return DriveStorage(creds, folder_id)
+    return backends[const.STORAGE.BACKEND]
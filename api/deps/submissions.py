@@ -0,0 +1,172 @@
+import shutil
+import asyncio
+import logging
+import datetime
+import tempfile
+import threading
+
+from api.db import crud
+from api.deps import const
+from api.deps.executor import executors, INFERENCE, STORAGE
+from api.deps.inference import ml_inference, notify, poll_delay
+
+
+log = logging.getLogger(const.APP_NAME)
+
+
+class InferenceBatch:
+    def __init__(self, clients: dict):
+        self.directory = tempfile.mkdtemp(prefix="inference-")
+        self.clients = clients
+        # Annotation id -> name of its input file
+        self.inputs = {}
+        # Inputs reserved in batch, launch waits until staging of all of
+        # them is finished
+        self.reserved = 0
+        self.staging = 0
+        self.staged = asyncio.Event()
+        self.staged.set()
+
+
+class InferenceSubmissions:
+    """
+    Collects MRIs sent to inference within short window and scores them by
+    one batch job over folder input, so bulk imports don't pay startup of
+    job for every series. MRIs are staged on disk until their batch is
+    launched, annotations get job name and input name at launch. Staged
+    annotations are marked queued, so they aren't served as ready, and are
+    tracked until launch, so scheduler fails only those lost with process.
+    Lock only assigns MRIs to batches, they are staged concurrently.
+    """
+
+    def __init__(self, window_seconds: float, batch_size: int):
+        self.window_seconds = window_seconds
+        self.batch_size = batch_size
+        self.batch = None
+        self.batch_lock = None
+        self.tasks = set()
+        self.queued = set()
+        self.lock = threading.Lock()
+
+        self.jobs = 0
+        self.inputs = 0
+        self.failed = 0
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def is_queued(self, annotation_id: int) -> bool:
+        return annotation_id in self.queued
+
+    async def submit(self, annotation_id: int, mri, clients: dict):
+        # Lock is bound to event loop, which doesn't exist on import
+        if self.batch_lock is None:
+            self.batch_lock = asyncio.Lock()
+
+        async with self.batch_lock:
+            if self.batch is None:
+                self.batch = InferenceBatch(clients)
+                self._spawn(self._launch_later(self.batch))
+            batch = self.batch
+
+            batch.reserved += 1
+            batch.staging += 1
+            batch.staged.clear()
+            self.queued.add(annotation_id)
+
+            full = batch.reserved >= self.batch_size
+            if full:
+                self.batch = None
+
+        name = ml_inference.input_name(annotation_id)
+        try:
+            await executors.run(
+                STORAGE, ml_inference.stage, batch.directory, name, mri
+            )
+            batch.inputs[annotation_id] = name
+        except BaseException:
+            self.queued.discard(annotation_id)
+            await crud.fail_inference(annotation_id)
+            raise
+        finally:
+            batch.staging -= 1
+            if batch.staging == 0:
+                batch.staged.set()
+            if full:
+                self._spawn(self._launch(batch))
+
+    async def _launch_later(self, batch: InferenceBatch):
+        await asyncio.sleep(self.window_seconds)
+        async with self.batch_lock:
+            if self.batch is not batch:
+                # Launched already when it was full
+                return
+            self.batch = None
+        await self._launch(batch)
+
+    async def flush(self):
+        # Staged MRIs are launched on shutdown, not lost with process
+        if self.batch_lock is None:
+            return
+        async with self.batch_lock:
+            batch, self.batch = self.batch, None
+        if batch is not None:
+            await self._launch(batch)
+
+    async def _launch(self, batch: InferenceBatch):
+        await batch.staged.wait()
+        try:
+            await self._start(batch)
+        finally:
+            self.queued.difference_update(batch.inputs)
+
+    async def _start(self, batch: InferenceBatch):
+        if not batch.inputs:
+            # Its only MRI was not staged
+            shutil.rmtree(batch.directory, ignore_errors=True)
+            return
+
+        try:
+            job_name = await executors.run(
+                INFERENCE, ml_inference.launch, batch.directory
+            )
+        except Exception:
+            with self.lock:
+                self.failed += len(batch.inputs)
+            log.exception(
+                f"Inference of {len(batch.inputs)} MRIs was not launched.",
+                extra={"topic": "INFERENCE"}
+            )
+            for annotation_id in batch.inputs:
+                await crud.fail_inference(annotation_id)
+            for annotation in await crud.get_inferences_by_ids(batch.inputs):
+                await notify(annotation, batch.clients, failed=True)
+            return
+        finally:
+            shutil.rmtree(batch.directory, ignore_errors=True)
+
+        with self.lock:
+            self.jobs += 1
+            self.inputs += len(batch.inputs)
+        await crud.start_inferences(
+            batch.inputs, job_name, datetime.datetime.now() + poll_delay(0)
+        )
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "window_seconds": self.window_seconds,
+                "batch_size": self.batch_size,
+                "staged": len(self.batch.inputs) if self.batch is not None else 0,
+                "jobs": self.jobs,
+                "inputs": self.inputs,
+                "failed": self.failed
+            }
+
+
+inference_submissions = InferenceSubmissions(
+    window_seconds=const.AZUREML.BATCH_WINDOW_SECONDS,
+    batch_size=const.AZUREML.BATCH_SIZE
+)
@@ -0,0 +1,226 @@
+import json
+import time
+import hashlib
+import random
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from googleapiclient.errors import HttpError
+
+from api.deps import const
+
+
+RATE_LIMIT_REASONS = {"userRateLimitExceeded", "rateLimitExceeded"}
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Repeating these could apply them twice, e.g. create second folder
+NON_IDEMPOTENT_METHODS = {"POST", "PATCH"}
+
+
+def error_reason(content: bytes) -> str | None:
+    try:
+        errors = json.loads(content)["error"]["errors"]
+        return errors[0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def is_rate_limited(status_code: int, content: bytes) -> bool:
+    return status_code == 429 or (
+        status_code == 403 and error_reason(content) in RATE_LIMIT_REASONS
+    )
+
+
+def is_retryable(status_code: int | None, content: bytes) -> bool:
+    # Missing status code means connection failure
+    return (
+        status_code is None
+        or status_code in RETRYABLE_STATUS
+        or is_rate_limited(status_code, content)
+    )
+
+
+def is_retryable_error(e: Exception) -> bool:
+    # Drive still refused after all retries, request can be repeated later
+    return isinstance(e, HttpError) and is_retryable(e.status_code, e.content)
+
+
+def user_key(creds) -> str:
+    # Rate limit of Drive is per user, refresh token identifies user, but
+    # it is secret, so it is not kept as is
+    if creds.refresh_token is None:
+        return str(id(creds))
+    return hashlib.sha256(creds.refresh_token.encode()).hexdigest()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Takes token and returns how long to wait for it, tokens can go
+        # negative, so waiting requests are served in order of arrival
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class DriveThrottle:
+    """
+    Keeps Drive requests of each user under Google's per-user rate limit
+    (token bucket), retries rate limited and failed requests with capped
+    exponential backoff with full jitter and limits concurrent uploads.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        upload_limit: int
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.upload_limit = upload_limit
+        self.upload_semaphore = None
+        self.buckets = {}
+        self.lock = threading.Lock()
+        # Bucket idle this long is full again, same as new one
+        self.idle_seconds = burst / rate
+        self.pruned_at = time.monotonic()
+
+        self.requests = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.uploads_waiting = 0
+        self.uploads_running = 0
+
+    def _count(self, counter: str, value=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def _prune(self, now: float):
+        # Called with lock held
+        if now - self.pruned_at < self.idle_seconds:
+            return
+        self.pruned_at = now
+        for key, bucket in list(self.buckets.items()):
+            if now - bucket.updated > self.idle_seconds:
+                del self.buckets[key]
+
+    def _bucket(self, key) -> TokenBucket:
+        with self.lock:
+            self._prune(time.monotonic())
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self.buckets[key] = bucket
+            return bucket
+
+    async def acquire(self, key):
+        self._count("requests")
+        delay = self._bucket(key).reserve()
+        if delay > 0:
+            self._count("throttled")
+            self._count("throttled_seconds", delay)
+            await asyncio.sleep(delay)
+
+    def backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        cap = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(0, cap)
+
+    def should_retry(
+        self,
+        attempt: int,
+        status_code: int | None = None,
+        content: bytes = b"",
+        idempotent: bool = True
+    ) -> bool:
+        if not is_retryable(status_code, content):
+            return False
+        if not idempotent and (
+            status_code is None or not is_rate_limited(status_code, content)
+        ):
+            # Request could have been applied, only rate limited one surely
+            # wasn't
+            return False
+
+        if status_code is not None and is_rate_limited(status_code, content):
+            self._count("rate_limited")
+        else:
+            self._count("server_errors")
+
+        if attempt >= self.max_retries:
+            self._count("gave_up")
+            return False
+
+        self._count("retries")
+        return True
+
+    @asynccontextmanager
+    async def upload_slot(self):
+        if self.upload_semaphore is None:
+            self.upload_semaphore = asyncio.Semaphore(self.upload_limit)
+
+        self._count("uploads_waiting")
+        try:
+            await self.upload_semaphore.acquire()
+        finally:
+            self._count("uploads_waiting", -1)
+
+        self._count("uploads_running")
+        try:
+            yield
+        finally:
+            self._count("uploads_running", -1)
+            self.upload_semaphore.release()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "users": len(self.buckets),
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "throttled_seconds": self.throttled_seconds,
+                "rate_limited": self.rate_limited,
+                "server_errors": self.server_errors,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "uploads_limit": self.upload_limit,
+                "uploads_waiting": self.uploads_waiting,
+                "uploads_running": self.uploads_running
+            }
+
+
+drive_throttle = DriveThrottle(
+    rate=const.DRIVE_THROTTLE.RATE,
+    burst=const.DRIVE_THROTTLE.BURST,
+    max_retries=const.DRIVE_THROTTLE.MAX_RETRIES,
+    backoff_base=const.DRIVE_THROTTLE.BACKOFF_BASE_SECONDS,
+    backoff_max=const.DRIVE_THROTTLE.BACKOFF_MAX_SECONDS,
+    upload_limit=const.DRIVE_THROTTLE.UPLOAD_LIMIT
+)
@@ -1,54 +1,63 @@
 import uuid
-from typing import List
+import hashlib
+from gzip import GzipFile
+from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import status, UploadFile
+from fastapi import status, Request, UploadFile
 from sqlalchemy.exc import IntegrityError
 
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from api.db import crud
 from api.deps import const
+from api.deps import drive
+from api.deps import storage
 from api.deps import utils
-from api.deps.inference import MLInference
-from api.deps.mri_file import MRIFile
+from api.deps.cache import drive_cache
+from api.deps.compression import is_gzip
+from api.deps.drive import drive_credentials
+from api.deps.drive_async import drive_client
+from api.deps.executor import executors, CONVERT, CRYPTO, DRIVE
+from api.deps.mri_file import MRIFile, is_decodable
+from api.deps.submissions import inference_submissions
+from api.deps.throttle import is_retryable_error
 from api.deps.utils import APIException
 
 
-def drive_folder_id(service):
-    # get folder_id for NeurAI folder
-    results = service.files().list(
-        q=const.GoogleAPI.CONTENT_FILTER,
-        fields="nextPageToken, files(id, name)"
-    ).execute()
-    items = results.get("files", [])
-    if not items:
-        return None
+_validation_executor = None
 
-    folder_id = items[0]["id"]
-    return folder_id
 
+def _get_validation_executor() -> ThreadPoolExecutor:
+    global _validation_executor
+    if _validation_executor is None:
+        _validation_executor = ThreadPoolExecutor(
+            max_workers=const.DICOM.VALIDATION_WORKERS,
+            thread_name_prefix="dicom"
+        )
+    return _validation_executor
 
-def drive_upload(mri: MRIFile, refresh_token: str) -> dict:
-    web_creds = const.GoogleAPI.CREDS["web"]
-    creds = Credentials(
-        None,
-        refresh_token=refresh_token,
-        token_uri=web_creds["token_uri"],
-        client_id=web_creds["client_id"],
-        client_secret=web_creds["client_secret"],
-        scopes=const.GoogleAPI.SCOPES,
-    )
-    service = build("drive", "v3", credentials=creds)
-    folder_id = drive_folder_id(service)
-    uploaded_file = mri.upload_encrypted(service, folder_id)
 
-    return uploaded_file
+async def storage_upload(
+    mri: MRIFile,
+    user_id: int,
+    refresh_token: str,
+    folder_id: str | None = None
+) -> dict:
+    creds = None
+    if const.STORAGE.BACKEND == storage.DRIVE:
+        creds = await executors.run(
+            DRIVE, drive_credentials.get, user_id, refresh_token
+        )
+        folder_id = await drive_client.verify_folder(creds, folder_id)
 
+    return await mri.store(storage.default_backend(creds, folder_id))
 
-def get_drive_folder_id(service, translation):
-    folder_id = drive_folder_id(service)
+
+async def get_drive_folder_id(user_id: int, translation):
+    # Stored and verified by validate_drive_token
+    folder_id = await crud.get_user_drive_folder_id(user_id)
 
     # if NeurAI folder doesn't exist we need to retry authorization
     if folder_id is None:
@@ -60,29 +69,198 @@ def get_drive_folder_id(service, translation):
     return folder_id
 
 
-def get_drive_folder_content(service, folder_id):
-    files = []
-    page_token = None
+async def refresh_drive_folder_id(creds, user_id: int, translation):
+    # Drive returned 404 for stored folder, search for it again
+    folder_id = await drive_client.find_folder(creds)
+    await crud.update_user_drive_folder_id(user_id, folder_id)
+    if folder_id is None:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["drive_folder_not_found"]},
+        )
 
-    while True:
-        response = service.files().list(
-            q=f"'{folder_id}' in parents and trashed=false",
-            fields="nextPageToken, files(id, name)",
-            pageToken=page_token
-        ).execute()
+    return folder_id
 
-        files.extend(response.get("files", []))
-        page_token = response.get("nextPageToken", None)
 
-        if page_token is None:
-            break
+async def get_drive_folder_content(service, user_id: int, folder_id: str):
+    # Files of NeurAI folder from index in database, brought up to date with
+    # Drive changes feed. Whole folder is listed only to build the index.
+    page_token = await crud.get_user_drive_page_token(user_id)
+    if page_token is not None:
+        try:
+            updated, removed, page_token = await executors.run(
+                DRIVE, drive.list_changes, service, page_token, folder_id
+            )
+            await crud.update_drive_files(user_id, updated, removed, page_token)
+            return [
+                {"id": f.file_id, "name": f.name}
+                for f in await crud.get_drive_files(user_id)
+            ]
+
+        except HttpError as e:
+            # Page token expired or is invalid, build index again
+            if e.status_code not in (
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_404_NOT_FOUND,
+                status.HTTP_410_GONE
+            ):
+                raise
+
+    # Token is taken before listing, so no change can be missed
+    page_token = await executors.run(DRIVE, drive.start_page_token, service)
+    files = await executors.run(DRIVE, drive.list_folder, service, folder_id)
+    await crud.replace_drive_files(user_id, files, page_token)
 
     return files
 
 
-def create_nifti(files: List[UploadFile], translation) -> MRIFile:
+def drive_error(e: HttpError, translation) -> APIException:
+    if is_retryable_error(e):
+        return APIException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"message": translation["drive_rate_limited"]}
+        )
+    if e.status_code == status.HTTP_404_NOT_FOUND:
+        return APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["file_not_found"]}
+        )
+    if e.status_code == status.HTTP_401_UNAUTHORIZED:
+        return APIException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={"message": translation["drive_authorization_failed"], "type": "google"}
+        )
+
+    return APIException(
+        status_code=e.status_code or status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={"message": translation["drive_request_failed"]}
+    )
+
+
+def get_drive_files(service, file_ids: List[str]) -> dict:
+    # Metadata of files by id in batches, files not found are left out
+    requests = [
+        service.files().get(fileId=file_id, fields="id, name, size, trashed")
+        for file_id in file_ids
+    ]
+    files = {}
+    for file_id, result in zip(file_ids, drive.execute_batch(service, requests)):
+        if isinstance(result, HttpError):
+            if result.status_code == status.HTTP_404_NOT_FOUND:
+                continue
+            raise result
+        files[file_id] = result
+
+    return files
+
+
+def drive_unauthorized(translation) -> APIException:
+    # File is in Drive, but user has not authorized it
+    return APIException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        content={"message": translation["drive_authorization_failed"], "type": "google"}
+    )
+
+
+def storage_error(e: Exception, translation) -> APIException:
+    if isinstance(e, HttpError):
+        return drive_error(e, translation)
+    return APIException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={"message": translation["storage_request_failed"]}
+    )
+
+
+async def delete_files(creds, file_ids: List[str], translation) -> dict:
+    # Files are deleted in batches by storage their key points to, returns
+    # errors of files which were not deleted
+    grouped = {}
+    for file_id in file_ids:
+        grouped.setdefault(storage.parse_key(file_id)[0], []).append(file_id)
+
+    errors = {}
+    for keys in grouped.values():
+        backend = storage.backend_for(keys[0], creds)
+        object_ids = [storage.parse_key(key)[1] for key in keys]
+        try:
+            failed = await executors.run(
+                backend.category, backend.delete, object_ids
+            )
+        except storage.Unauthorized:
+            raise drive_unauthorized(translation)
+
+        for key, object_id in zip(keys, object_ids):
+            if object_id in failed:
+                errors[key] = storage_error(failed[object_id], translation)
+            else:
+                drive_cache.remove(key)
+
+    return errors
+
+
+async def reconcile_drive_files(user):
+    # Bring index of NeurAI folder up to date and flag files missing in it
+    creds = await executors.run(
+        DRIVE, drive_credentials.get, user.id, user.refresh_token
+    )
+    service = drive.service(creds)
+    await get_drive_folder_content(service, user.id, user.drive_folder_id)
+
+    # Files not in index are confirmed by Drive before they are flagged
+    candidates = await crud.get_unindexed_file_ids(user.id)
+    present = set()
+    if candidates:
+        files = await executors.run(DRIVE, get_drive_files, service, candidates)
+        present = {
+            file_id for file_id, file in files.items() if not file.get("trashed")
+        }
+
+    await crud.update_drive_missing(user.id, present)
+
+
+def file_hash(f, compressed: bool = False) -> str:
+    f.seek(0)
+    fileobj = GzipFile(fileobj=f) if compressed else f
+    digest = hashlib.sha256()
+    while True:
+        chunk = fileobj.read(const.COMPRESSION.BLOCK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def content_hash(files: List[UploadFile]) -> str | None:
+    # NIfTI is hashed uncompressed, so compression level doesn't matter.
+    # DICOM series is hashed by its files in any order, before conversion.
+    if len(files) == 1:
+        f = files[0].file
+        f.seek(0)
+        try:
+            return file_hash(f, is_gzip(f))
+        except (OSError, EOFError):
+            # Corrupted gzip, validation rejects it
+            f.seek(0)
+            return None
+
+    digests = sorted(_get_validation_executor().map(
+        lambda f: file_hash(f.file), files
+    ))
+    return hashlib.sha256("".join(digests).encode()).hexdigest()
+
+
+def create_nifti(
+    files: List[UploadFile],
+    translation,
+    progress: Callable | None = None
+) -> MRIFile:
     # Upload either 1 DICOM sequence or 1 NIfTI file
     # Check for one NIfti
+    if progress is not None:
+        progress("validating")
+
     if len(files) == 1:
         f = files[0]
         mri = MRIFile(filename=str(uuid.uuid4()), content=f.file)
@@ -94,19 +272,39 @@ def create_nifti(files: List[UploadFile], translation) -> MRIFile:
             )
     else:
         # Check for DICOM only series
-        dicom_files = []
-        for f in files:
-            mri = MRIFile(filename=f.filename, content=f.file)
-            if not mri.is_dicom():
-                raise APIException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    content={
-                        "message": translation["more_than_one_scanning_uploaded"]
-                    },
-                )
-            dicom_files.append(mri)
+        dicom_files = [
+            MRIFile(filename=f.filename, content=f.file) for f in files
+        ]
+        headers = list(_get_validation_executor().map(
+            MRIFile.read_dicom_header, dicom_files
+        ))
+        if None in headers:
+            raise APIException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"message": translation["mri_files_invalid"]},
+            )
+
+        series_uids = {header["series_uid"] for header in headers}
+        if len(series_uids) > 1:
+            raise APIException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={
+                    "message": translation["more_than_one_scanning_uploaded"]
+                },
+            )
+
+        if not all(is_decodable(h["transfer_syntax"]) for h in headers):
+            # Compressed pixel data would fail only in conversion worker
+            raise APIException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"message": translation["dicom_transfer_syntax_unsupported"]},
+            )
+
+        if progress is not None:
+            progress("converting")
 
         mri = MRIFile(filename=str(uuid.uuid4()), content=None)
+        mri.series_uid = series_uids.pop() if series_uids else None
         result = mri.from_dicom(dicom_files)
         if result is False:
             raise APIException(
@@ -117,15 +315,78 @@ def create_nifti(files: List[UploadFile], translation) -> MRIFile:
     return mri
 
 
-def file_upload(files: List[UploadFile], creds: Credentials, translation) -> dict:
-    mri = create_nifti(files, translation)
-    service = build("drive", "v3", credentials=creds)
-    folder_id = get_drive_folder_id(service, translation)
+async def file_upload(
+    files: List[UploadFile],
+    creds: Credentials,
+    user_id: int,
+    translation,
+    request: Request | None = None,
+    progress: Callable | None = None
+) -> dict:
+    # Blocking stages run in executors, stages not started yet are skipped
+    # and upload is cancelled when client disconnects
+    mri = await executors.run(
+        CONVERT, create_nifti, files, translation, progress, request=request
+    )
+    try:
+        return await store_nifti(
+            mri, creds, user_id, translation, request, progress
+        )
+    except BaseException:
+        mri.close()
+        raise
+
+
+def close_content(uploaded_file: dict):
+    # Content is kept open after upload only for inference
+    content = uploaded_file.get("content")
+    if content is not None:
+        content.close()
+
+
+async def store_nifti(
+    mri: MRIFile,
+    creds: Credentials,
+    user_id: int,
+    translation,
+    request: Request | None = None,
+    progress: Callable | None = None
+) -> dict:
+    folder_id = None
+    if const.STORAGE.BACKEND == storage.DRIVE:
+        folder_id = await get_drive_folder_id(user_id, translation)
+
+    async def upload(folder_id):
+        work = mri.store(storage.default_backend(creds, folder_id), progress)
+        if request is None:
+            return await work
+        return await executors.watch(work, request)
 
     try:
-        uploaded_file = mri.upload_encrypted(service, folder_id)
+        try:
+            uploaded_file = await upload(folder_id)
+        except HttpError as e:
+            # Only Drive raises HttpError, its folder was removed
+            if e.status_code != status.HTTP_404_NOT_FOUND:
+                raise
+            folder_id = await refresh_drive_folder_id(
+                creds, user_id, translation
+            )
+            uploaded_file = await upload(folder_id)
+        uploaded_file["series_uid"] = mri.series_uid
+
+    except storage.Unauthorized:
+        raise drive_unauthorized(translation)
+
+    except OSError:
+        raise APIException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={"message": translation["storage_request_failed"]},
+        )
 
     except HttpError as e:
+        if is_retryable_error(e):
+            raise drive_error(e, translation)
         status_code = (
             e.status_code if e.status_code else status.HTTP_500_INTERNAL_SERVER_ERROR
         )
@@ -144,7 +405,8 @@ async def annotation_upload(
     user_id: int,
     mri_id: int,
     name: str,
-    translation
+    translation,
+    request: Request | None = None
 ):
     try:
         annotation_id = await crud.create_annotation_file(
@@ -160,7 +422,14 @@ async def annotation_upload(
             content={"message": translation["annotation_name_exists"]}
         )
 
-    new_file = file_upload(files, creds, translation)
+    try:
+        new_file = await file_upload(files, creds, user_id, translation, request)
+    except BaseException:
+        # Don't leave annotation without file behind
+        await crud.delete_annotation(annotation_id)
+        raise
+    close_content(new_file)
+
     await crud.update_annotation_file(
         id=annotation_id,
         filename=new_file["name"],
@@ -179,25 +448,93 @@ async def mri_upload(
     screening_id: int,
     user_id: int,
     translation,
-    series_uid: str = None
+    series_uid: str = None,
+    request: Request | None = None,
+    progress: Callable | None = None
 ):
-    new_file = file_upload(files, creds, translation)
-    new_file["id"] = await crud.create_mri_file(
-        filename=new_file["name"],
-        file_id=new_file["id"],
-        patient_id=patient_id,
-        screening_id=screening_id,
-        user_id=user_id,
-        series_uid=series_uid
+    # Content uploaded by the user before is reused with its AI annotation,
+    # without conversion, upload and inference
+    digest = await executors.run(CRYPTO, content_hash, files, request=request)
+    if digest is not None:
+        existing = await crud.get_mri_file_by_hash(user_id, digest, screening_id)
+        if existing is not None:
+            reused = await reuse_mri_file(
+                existing, patient_id, screening_id, user_id
+            )
+            if reused is not None:
+                return reused
+
+    new_file = await file_upload(
+        files, creds, user_id, translation, request, progress
     )
+    try:
+        new_file["id"] = await crud.create_mri_file(
+            filename=new_file["name"],
+            file_id=new_file["id"],
+            patient_id=patient_id,
+            screening_id=screening_id,
+            user_id=user_id,
+            series_uid=series_uid or new_file["series_uid"],
+            content_hash=digest
+        )
+    except BaseException:
+        close_content(new_file)
+        raise
 
     return new_file
 
 
+def is_reusable(annotation) -> bool:
+    # Only finished or launched inference is shared, staged one may be lost
+    if annotation is None or annotation.failed:
+        return False
+    return annotation.file_id is not None or annotation.job_name is not None
+
+
+async def reuse_mri_file(
+    mri,
+    patient_id: str,
+    screening_id: int,
+    user_id: int
+) -> dict | None:
+    annotation = await crud.get_ai_annotation_by_mri_id(mri.id)
+    if const.AZUREML.ENABLED is True and not is_reusable(annotation):
+        # Inference needs content, upload it again
+        return None
+
+    if mri.screening_id != screening_id:
+        # Both records point to the same stored file
+        try:
+            mri_id = await crud.create_mri_file(
+                filename=mri.filename,
+                file_id=mri.file_id,
+                patient_id=patient_id,
+                screening_id=screening_id,
+                user_id=user_id,
+                series_uid=mri.series_uid,
+                content_hash=mri.content_hash
+            )
+        except IntegrityError:
+            # Name is taken in this screening, new upload gets unique one
+            return None
+        await crud.copy_ai_annotation(mri.id, mri_id, patient_id, user_id)
+        mri = await crud.get_mri_file_by_id(mri_id)
+
+    return {
+        "id": mri.id,
+        "name": mri.filename,
+        "series_uid": mri.series_uid,
+        "created_at": mri.created_at,
+        "modified_at": mri.modified_at,
+        "duplicate": True
+    }
+
+
 async def mri_auto_annotate(
     upload_file: dict,
     patient_id: int,
     user_id: int,
+    clients: dict,
     translation
 ):
     mri_id = upload_file["id"]
@@ -208,7 +545,8 @@ async def mri_auto_annotate(
             mri_id=mri_id,
             patient_id=patient_id,
             user_id=user_id,
-            is_ai=True
+            is_ai=True,
+            queued=True
         )
     except IntegrityError:
         raise APIException(
@@ -216,7 +554,7 @@ async def mri_auto_annotate(
             content={"message": translation["annotation_name_exists"]}
         )
 
-    ml = MLInference()
-    job_name = ml.launch(upload_file["content"])
-
-    await crud.start_inference(annotation_id, job_name)
+    # Job is launched with other MRIs submitted within batch window
+    await inference_submissions.submit(
+        annotation_id, upload_file["content"], clients
+    )
@@ -1,6 +1,8 @@
 import json
+import base64
 import logging
 from random import choices
+from typing import Iterable, Iterator
 import string
 from fastapi import status, Request
 
@@ -21,18 +23,17 @@ async def get_logger():
     return logging.getLogger(const.APP_NAME)
 
 
-async def get_mri_files_and_annotations_per_screening(user, files, screening_id):
+async def get_mri_files_and_annotations_per_screening(user, screening_id):
     mri_files = []
-    drive_file_ids = [record["id"] for record in files]
 
-    for file in user.mri_files:
-        if file.file_id in drive_file_ids and file.screening_id == screening_id:
+    for file in get_existing_files_per_user(user.mri_files):
+        if file.screening_id == screening_id:
             annotations = await crud.get_annotations_by_mri_and_user(
                 mri_id=file.id, user_id=user.id
             )
 
             # verify annotation presence in drive
-            annotations = get_existing_files_per_user(annotations, files)
+            annotations = get_existing_files_per_user(annotations)
             mri_files.append({
                 "id": file.id,
                 "name": file.filename,
@@ -49,14 +50,15 @@ def generate_unique_patient_id():
     return ''.join(choices(string.ascii_uppercase + string.digits, k=10))
 
 
-def get_existing_files_per_user(files, drive_files):
-    annotation_files = []
-    drive_file_ids = [record["id"] for record in drive_files]
+def get_existing_files_per_user(files):
+    # Files deleted in Drive are flagged by reconciler, AI annotations are
+    # listed even while their file is not uploaded yet
+    existing_files = []
     for file in files:
-        if (file.file_id in drive_file_ids) or (file.is_ai):
-            annotation_files.append(file)
+        if not file.drive_missing or getattr(file, "is_ai", False):
+            existing_files.append(file)
 
-    return annotation_files
+    return existing_files
 
 
 async def verify_file_creator(file_id, user_id, file_type, translation):
@@ -92,17 +94,69 @@ def get_localization_data(request: Request):
     return json.load(translation)
 
 
-def get_screenings_and_mri_files_per_patient(
-        files,
-        screenings
-):
+def get_screenings_and_mri_files_per_patient(screenings):
     studies = []
 
     for study in screenings:
-        series = get_existing_files_per_user(study.mri_files, files)
+        series = get_existing_files_per_user(study.mri_files)
         studies.append({
             'study_uid': study.study_uid,
             'mri_files': series
         })
 
     return studies
+
+
+def base64_json_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # Encode byte chunks as one JSON string of base64, same as returning
+    # base64.b64encode(content) from endpoint, without joining the content
+    yield b'"'
+    rest = b""
+    for chunk in chunks:
+        chunk = rest + chunk
+        aligned = len(chunk) - len(chunk) % 3
+        rest = chunk[aligned:]
+        if aligned:
+            yield base64.b64encode(chunk[:aligned])
+
+    yield base64.b64encode(rest) + b'"'
+
+
+def parse_range_header(value: str | None, size: int) -> tuple[int, int] | None:
+    # Single byte range "bytes=start-end", "bytes=start-" or "bytes=-suffix".
+    # Returns None when whole content should be sent, raises ValueError
+    # for unsatisfiable range
+    if not value or not value.startswith("bytes=") or "," in value:
+        return None
+
+    first, _, last = value[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start = size - int(last)
+            end = size - 1
+    except ValueError:
+        return None
+
+    start = max(start, 0)
+    end = min(end, size - 1)
+    if start > end:
+        raise ValueError("Range not satisfiable")
+
+    return start, end
+
+
+def parse_content_range(value: str | None) -> tuple[int, int, int]:
+    # Chunk of upload "bytes start-end/total", raises ValueError if invalid
+    if not value or not value.startswith("bytes "):
+        raise ValueError("Invalid Content-Range")
+
+    span, _, total = value[len("bytes "):].strip().partition("/")
+    first, _, last = span.partition("-")
+    start, end, total = int(first), int(last), int(total)
+    if start < 0 or start > end or end >= total:
+        raise ValueError("Invalid Content-Range")
+
+    return start, end, total
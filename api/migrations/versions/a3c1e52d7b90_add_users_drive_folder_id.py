@@ -0,0 +1,26 @@
+"""add_users_drive_folder_id
+
+Revision ID: a3c1e52d7b90
+Revises: 790065de4f9f
+Create Date: 2023-05-08 19:12:44.120318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a3c1e52d7b90"
+down_revision = "790065de4f9f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("drive_folder_id", sa.String(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "drive_folder_id")
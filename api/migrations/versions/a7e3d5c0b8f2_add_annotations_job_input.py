@@ -0,0 +1,27 @@
+"""add_annotations_job_input
+
+Revision ID: a7e3d5c0b8f2
+Revises: f4c8a2d91b37
+Create Date: 2023-05-19 09:47:15.628403
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "a7e3d5c0b8f2"
+down_revision = "f4c8a2d91b37"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Input file of annotation in batch job, jobs launched before have one
+    op.add_column(
+        "annotations",
+        sa.Column("job_input", sa.String(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("annotations", "job_input")
@@ -0,0 +1,34 @@
+"""create_drive_files_table
+
+Revision ID: c5d0f81e4a27
+Revises: a3c1e52d7b90
+Create Date: 2023-05-09 21:03:17.562093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c5d0f81e4a27"
+down_revision = "a3c1e52d7b90"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table("drive_files",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("file_id", sa.String(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "file_id")
+    )
+    op.add_column(
+        "users",
+        sa.Column("drive_page_token", sa.String(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "drive_page_token")
+    op.drop_table("drive_files")
@@ -0,0 +1,27 @@
+"""add_annotations_queued_at
+
+Revision ID: c9d4b6e1f3a8
+Revises: a7e3d5c0b8f2
+Create Date: 2023-05-24 14:12:38.905117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "c9d4b6e1f3a8"
+down_revision = "a7e3d5c0b8f2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # MRI staged for batch job, annotation is not ready until job finishes
+    op.add_column(
+        "annotations",
+        sa.Column("queued_at", sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("annotations", "queued_at")
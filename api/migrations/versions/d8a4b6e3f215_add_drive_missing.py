@@ -0,0 +1,37 @@
+"""add_drive_missing
+
+Revision ID: d8a4b6e3f215
+Revises: c5d0f81e4a27
+Create Date: 2023-05-10 18:47:02.914735
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "d8a4b6e3f215"
+down_revision = "c5d0f81e4a27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "mri_files",
+        sa.Column(
+            "drive_missing", sa.Boolean(),
+            nullable=False, server_default=sa.false()
+        )
+    )
+    op.add_column(
+        "annotations",
+        sa.Column(
+            "drive_missing", sa.Boolean(),
+            nullable=False, server_default=sa.false()
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("annotations", "drive_missing")
+    op.drop_column("mri_files", "drive_missing")
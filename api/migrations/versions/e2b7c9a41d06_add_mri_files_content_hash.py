@@ -0,0 +1,32 @@
+"""add_mri_files_content_hash
+
+Revision ID: e2b7c9a41d06
+Revises: d8a4b6e3f215
+Create Date: 2023-05-12 10:21:37.482915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "e2b7c9a41d06"
+down_revision = "d8a4b6e3f215"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "mri_files",
+        sa.Column("content_hash", sa.String(length=64), nullable=True)
+    )
+    op.create_index(
+        "ix_mri_files_created_by_content_hash",
+        "mri_files",
+        ["created_by", "content_hash"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_mri_files_created_by_content_hash", table_name="mri_files")
+    op.drop_column("mri_files", "content_hash")
@@ -0,0 +1,52 @@
+"""add_annotations_poll_schedule
+
+Revision ID: f4c8a2d91b37
+Revises: e2b7c9a41d06
+Create Date: 2023-05-16 14:08:52.301764
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "f4c8a2d91b37"
+down_revision = "e2b7c9a41d06"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "annotations",
+        sa.Column("job_started_at", sa.DateTime(), nullable=True)
+    )
+    op.add_column(
+        "annotations",
+        sa.Column("next_poll_at", sa.DateTime(), nullable=True)
+    )
+    op.add_column(
+        "annotations",
+        sa.Column("poll_count", sa.Integer(), server_default="0", nullable=False)
+    )
+    op.add_column(
+        "annotations",
+        sa.Column("failed", sa.Boolean(), server_default=sa.false(), nullable=False)
+    )
+    op.create_index(
+        "ix_annotations_next_poll_at",
+        "annotations",
+        ["next_poll_at"]
+    )
+    # Running jobs are checked on next run, timeout counts from creation
+    op.execute(
+        "UPDATE annotations SET job_started_at = created_at "
+        "WHERE job_name IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_annotations_next_poll_at", table_name="annotations")
+    op.drop_column("annotations", "failed")
+    op.drop_column("annotations", "poll_count")
+    op.drop_column("annotations", "next_poll_at")
+    op.drop_column("annotations", "job_started_at")
@@ -1,11 +1,15 @@
+import uuid
+
 from fastapi import APIRouter, Depends, status, Response, Header
 
 import google_auth_oauthlib.flow
-from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 
 from api.db import crud
-from api.deps import utils, upload, const
+from api.deps import utils, const
+from api.deps.drive import drive_credentials
+from api.deps.drive_async import drive_client
+from api.deps.drive_fake import fake_drive
 from api.deps.auth import (
     validate_api_token, validate_drive_token
 )
@@ -23,6 +27,13 @@ router = APIRouter(
     response_model=s.AuthorizationURL, dependencies=[Depends(validate_api_token)]
 )
 async def drive_authorize():
+    if fake_drive is not None:
+        # Fake Drive accepts any code, every code is separate Drive
+        code = uuid.uuid4().hex
+        return {
+            "autorization_url": f"{const.GoogleAPI.REDIRECT_URL}?code={code}&state=fake"
+        }
+
     flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
         const.GoogleAPI.CREDS_FILE,
         const.GoogleAPI.SCOPES,
@@ -54,9 +65,12 @@ async def drive_authorize_code(
     )
 
     try:
-        flow.fetch_token(code=code)
-        creds = flow.credentials
-        creds.refresh(Request())
+        if fake_drive is not None:
+            creds = fake_drive.authorize(code)
+        else:
+            flow.fetch_token(code=code)
+            creds = flow.credentials
+            creds.refresh(Request())
 
     except Exception:
         raise APIException(
@@ -67,11 +81,9 @@ async def drive_authorize_code(
     await crud.update_user_refresh_token(
         user_id=user_id, refresh_token=creds.refresh_token
     )
+    drive_credentials.evict(user_id)
 
-    service = build("drive", "v3", credentials=creds)
-    about = service.about().get(
-        fields="user(emailAddress)"
-    ).execute()
+    about = await drive_client.about(creds, "user(emailAddress)")
     email = about["user"].get("emailAddress", "")
     await crud.update_user_associated_drive(user_id=user_id, email=email)
 
@@ -90,39 +102,18 @@ async def drive_get_files(
     user_id: int = Depends(validate_api_token),
     translation=Depends(get_localization_data)
 ):
-    service = build("drive", "v3", credentials=creds)
-
-    folder_id = upload.get_drive_folder_id(service, translation)
-    q = f"'{folder_id}' in parents and trashed=false"
-
-    # list the folder content
-    files = []
-    page_token = None
-    while True:
-        response = (
-            service.files()
-            .list(q=q, fields="nextPageToken, files(id, name)", pageToken=page_token)
-            .execute()
-        )
-        files.extend(response.get("files", []))
-        page_token = response.get("nextPageToken", None)
-        if page_token is None:
-            break
-
     users_files = []
     user = await crud.get_user_by_id(user_id)
     if user.mri_files:
-        drive_file_ids = [record["id"] for record in files]
-        for file in user.mri_files:
-            if file.file_id in drive_file_ids:
-                users_files.append(
-                    {
-                        "id": file.file_id,
-                        "name": file.filename,
-                        "patient_name": f"{file.patient.forename} {file.patient.surname}",
-                        "modified_at": file.modified_at,
-                    }
-                )
+        for file in utils.get_existing_files_per_user(user.mri_files):
+            users_files.append(
+                {
+                    "id": file.file_id,
+                    "name": file.filename,
+                    "patient_name": f"{file.patient.forename} {file.patient.surname}",
+                    "modified_at": file.modified_at,
+                }
+            )
 
     return {"files": users_files}
 
@@ -133,6 +124,7 @@ async def drive_remove_authorization(
     log=Depends(get_logger)
 ):
     await crud.update_user_refresh_token(user_id=user_id, refresh_token=None)
+    drive_credentials.evict(user_id)
     await crud.update_user_associated_drive(user_id=user_id, email=None)
 
     user = await crud.get_user_by_id(user_id)
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, Request, status
+
+import api.deps.schema as s
+from api.db import crud
+from api.deps.auth import validate_callback_secret
+from api.deps.results import inference_results
+from api.deps.utils import APIException, get_localization_data
+
+router = APIRouter(
+    prefix="/inference",
+    tags=["inference"],
+    dependencies=[Depends(validate_callback_secret)],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.post(
+    "/callback",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def inference_callback(
+    callback: s.InferenceCallback,
+    request: Request,
+    translation=Depends(get_localization_data)
+):
+    # Callback only triggers retrieval, job status is verified in Azure
+    annotations = await crud.get_inferences_by_job_name(callback.job_name)
+    if not annotations:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["inference_job_not_found"]},
+        )
+
+    inference_results.submit(
+        callback.job_name, annotations, request.app.clients, wait=True
+    )
+    return {"job_name": callback.job_name}
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends
+
+from api.deps.auth import validate_api_token
+from api.deps.cache import drive_cache
+from api.deps.drive import drive_credentials
+from api.deps.drive_fake import fake_drive
+from api.deps.executor import executors
+from api.deps.inference import ml_inference
+from api.deps.mri_file import conversion_pool
+from api.deps.results import inference_results
+from api.deps.submissions import inference_submissions
+from api.deps.throttle import drive_throttle
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    dependencies=[Depends(validate_api_token)],
+)
+
+
+@router.get("")
+async def metrics_overview():
+    metrics = {
+        "cache": drive_cache.stats(),
+        "conversion": conversion_pool.stats(),
+        "credentials": drive_credentials.stats(),
+        "executors": executors.stats(),
+        "inference": ml_inference.stats(),
+        "inference_results": inference_results.stats(),
+        "inference_submissions": inference_submissions.stats(),
+        "throttle": drive_throttle.stats()
+    }
+    if fake_drive is not None:
+        metrics["fake_drive"] = fake_drive.stats()
+
+    return metrics
@@ -1,5 +1,6 @@
+import os
 import asyncio
-import base64
+import functools
 import json
 
 from fastapi import (
@@ -10,21 +11,26 @@ from fastapi import (
     Form,
     File,
     UploadFile,
-    Request
+    Request,
+    Query
 )
+from fastapi.responses import StreamingResponse
 from sqlalchemy.exc import IntegrityError
+from googleapiclient.errors import HttpError
 
-from typing import List
-from googleapiclient.discovery import build
+from typing import Callable, Iterator, List
 from sse_starlette.sse import EventSourceResponse
 
 import api.deps.schema as s
 from api.db import crud
 from api.deps import utils
 from api.deps import upload
+from api.deps import storage
+from api.deps.cache import drive_cache
+from api.deps.executor import executors, CRYPTO
 from api.deps.mri_file import MRIFile
 from api.deps.upload import annotation_upload
-from api.deps.utils import APIException, get_localization_data
+from api.deps.utils import APIException, get_localization_data, get_logger
 from api.deps.auth import validate_api_token, validate_drive_token
 
 
@@ -34,16 +40,169 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+BINARY_MEDIA_TYPE = "application/octet-stream"
 
-@router.get("/{id}", dependencies=[Depends(validate_api_token)])
-async def load_mri_file(id: int, creds=Depends(validate_drive_token)):
 
-    service = build("drive", "v3", credentials=creds)
+def prepend(first, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    try:
+        yield first
+        yield from chunks
+    finally:
+        chunks.close()
+
+
+async def open_stream(category: str, chunks: Iterator[bytes], translation):
+    # First chunk is downloaded before headers are sent, so missing file or
+    # revoked access is answered with error instead of truncated body
+    sentinel = object()
+    try:
+        first = await executors.run(category, next, chunks, sentinel)
+    except HttpError as e:
+        raise upload.drive_error(e, translation)
+    except storage.Unauthorized:
+        raise upload.drive_unauthorized(translation)
+    except FileNotFoundError:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["file_not_found"]}
+        )
+
+    if first is sentinel:
+        return iter(())
+    return prepend(first, chunks)
+
+
+async def download_backend(file_id: str, user_id: int, log, translation):
+    # Drive token is looked up only for files which are downloaded from Drive
+    creds = None
+    if storage.is_drive(file_id):
+        creds = await validate_drive_token(
+            user_id=user_id, log=log, translation=translation
+        )
+    return storage.backend_for(file_id, creds)
+
+
+async def decrypted_file_response(
+    request: Request,
+    file_id: str,
+    user_id: int,
+    log,
+    translation
+):
     f_e = MRIFile(filename="", content="")
-    mri = await crud.get_mri_file_by_id(id)
-    f_e.download_decrypted(service, mri.file_id)
+    # Cache is checked once, cached content is only decrypted from handle
+    # opened here, otherwise it's downloaded from storage
+    cached = drive_cache.open(file_id)
+    if cached is None:
+        backend = await download_backend(file_id, user_id, log, translation)
+        return await file_response(
+            request,
+            file_id,
+            backend.category,
+            functools.partial(f_e.download_size, backend, file_id),
+            functools.partial(f_e.stored_decrypted_stream, backend, file_id),
+            translation
+        )
 
-    return base64.b64encode(f_e.content)
+    try:
+        response = await file_response(
+            request,
+            file_id,
+            CRYPTO,
+            lambda: os.fstat(cached.fileno()).st_size,
+            functools.partial(f_e.cached_decrypted_stream, cached),
+            translation
+        )
+    except BaseException:
+        cached.close()
+        raise
+    if not isinstance(response, StreamingResponse):
+        cached.close()
+    return response
+
+
+async def file_response(
+    request: Request,
+    file_id: str,
+    category: str,
+    download_size: Callable[[], int],
+    download_stream: Callable[..., Iterator[bytes]],
+    translation
+):
+    if BINARY_MEDIA_TYPE not in request.headers.get("Accept", ""):
+        # Legacy mode, whole file as JSON string of base64
+        chunks = await open_stream(category, download_stream(), translation)
+        return StreamingResponse(
+            executors.iterate(category, utils.base64_json_stream(chunks)),
+            media_type="application/json"
+        )
+
+    try:
+        size = await executors.run(category, download_size)
+    except HttpError as e:
+        raise upload.drive_error(e, translation)
+    except storage.Unauthorized:
+        raise upload.drive_unauthorized(translation)
+    except FileNotFoundError:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["file_not_found"]}
+        )
+    # Drive file IDs are immutable content handles
+    etag = f'"{file_id}"'
+    headers = {"Accept-Ranges": "bytes", "ETag": etag}
+
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = None
+    if request.headers.get("If-Range", etag) == etag:
+        try:
+            byte_range = utils.parse_range_header(
+                request.headers.get("Range"), size
+            )
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers=headers
+            )
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        chunks = await open_stream(category, download_stream(), translation)
+        return StreamingResponse(
+            executors.iterate(category, chunks),
+            media_type=BINARY_MEDIA_TYPE,
+            headers=headers
+        )
+
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    chunks = await open_stream(
+        category, download_stream(start=start, end=end), translation
+    )
+    return StreamingResponse(
+        executors.iterate(category, chunks),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=BINARY_MEDIA_TYPE,
+        headers=headers
+    )
+
+
+@router.get("/{id}")
+async def load_mri_file(
+    id: int,
+    request: Request,
+    user_id: int = Depends(validate_api_token),
+    log=Depends(get_logger),
+    translation=Depends(get_localization_data)
+):
+    mri = await crud.get_mri_file_by_id(id)
+    return await decrypted_file_response(
+        request, mri.file_id, user_id, log, translation
+    )
 
 
 @router.patch(
@@ -71,6 +230,7 @@ async def rename_mri(
 @router.post("/{id}/annotations", response_model=s.AnnotationFiles)
 async def upload_annotation(
     id: int,
+    request: Request,
     name: None | str = Form(default=None),
     files: List[UploadFile] = File(...),
     user_id: int = Depends(validate_api_token),
@@ -85,7 +245,8 @@ async def upload_annotation(
         user_id=user_id,
         mri_id=mri.id,
         name=name,
-        translation=translation
+        translation=translation,
+        request=request
     )
     return {"id": new_file["id"]}
 
@@ -97,47 +258,42 @@ async def upload_annotation(
 async def annotations(
     id: int,
     user_id: int = Depends(validate_api_token),
-    creds=Depends(validate_drive_token),
     translation=Depends(get_localization_data)
 ):
-    service = build("drive", "v3", credentials=creds)
-    folder_id = upload.get_drive_folder_id(service, translation)
-    # get gdrive folder content
-    files = upload.get_drive_folder_content(service, folder_id)
-
     annotations_list = await crud.get_annotations_by_mri_and_user(id, user_id)
 
-    return utils.get_existing_files_per_user(annotations_list, files)
+    return utils.get_existing_files_per_user(annotations_list)
 
 
-@router.get(
-    "/{id}/annotations/{annotation_id}",
-    dependencies=[Depends(validate_api_token)]
-)
+@router.get("/{id}/annotations/{annotation_id}")
 async def load_annotation(
     id: int,
     annotation_id: int,
-    creds=Depends(validate_drive_token),
+    request: Request,
+    user_id: int = Depends(validate_api_token),
+    log=Depends(get_logger),
     translation=Depends(get_localization_data)
 ):
-    service = build("drive", "v3", credentials=creds)
-    f_e = MRIFile(filename="", content="")
-
     annotation = await crud.get_annotation_by_id(annotation_id)
     if annotation is None:
         raise APIException(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": translation["annotation_not_found"]},
         )
+    if annotation.failed is True:
+        raise APIException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"message": translation["annotation_failed"]},
+        )
     if annotation.ready is False:
         raise APIException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             content={"message": translation["annotation_not_ready"]},
         )
 
-    f_e.download_decrypted(service, annotation.file_id)
-
-    return base64.b64encode(f_e.content)
+    return await decrypted_file_response(
+        request, annotation.file_id, user_id, log, translation
+    )
 
 
 @router.delete(
@@ -149,8 +305,6 @@ async def remove_annotation(
     user_id: int = Depends(validate_api_token),
     translation=Depends(get_localization_data)
 ):
-    service = build("drive", "v3", credentials=creds)
-
     annotation = await utils.verify_file_creator(
         annotation_id,
         user_id,
@@ -158,21 +312,63 @@ async def remove_annotation(
         translation
     )
 
+    await remove_annotations([annotation], creds, translation)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.delete(
+    "/{id}/annotations",
+)
+async def remove_annotations_bulk(
+    id: int,
+    annotation_id: List[int] = Query(...),
+    creds=Depends(validate_drive_token),
+    user_id: int = Depends(validate_api_token),
+    translation=Depends(get_localization_data)
+):
+    annotations = []
+    for i in annotation_id:
+        annotation = await utils.verify_file_creator(
+            i,
+            user_id,
+            "annotation",
+            translation
+        )
+        if annotation.mri_file_id != id:
+            raise APIException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={"message": translation["annotation_not_found"]}
+            )
+        annotations.append(annotation)
+
+    await remove_annotations(annotations, creds, translation)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def remove_annotations(annotations: list, creds, translation):
+    # Files of all annotations are deleted in one batch request per storage
+    deleted = []
     try:
-        if annotation.is_ai is True:
-            # soft delete
-            update_values = { "visible": False }
-            await crud.update_annotation_details(annotation_id, update_values)
-        else:
-            await crud.delete_annotation(annotation_id)
-            service.files().delete(fileId=annotation.file_id).execute()
+        for annotation in annotations:
+            if annotation.is_ai is True:
+                # soft delete
+                update_values = { "visible": False }
+                await crud.update_annotation_details(annotation.id, update_values)
+            else:
+                await crud.delete_annotation(annotation.id)
+                if annotation.file_id is not None:
+                    deleted.append(annotation.file_id)
     except Exception:
         raise APIException(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": translation["file_not_found"]}
         )
 
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    errors = await upload.delete_files(creds, deleted, translation)
+    if errors:
+        raise next(iter(errors.values()))
 
 
 @router.patch(
@@ -1,13 +1,14 @@
 from typing import List
 
-from fastapi import APIRouter, Depends, File, UploadFile, status
-from googleapiclient.discovery import build
+from fastapi import APIRouter, Depends, File, Request, UploadFile, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.exc import IntegrityError
 
 import api.deps.schema as s
 from api.db import crud
-from api.deps import utils, upload, const
+from api.deps import utils, upload, const, jobs
 from api.deps.auth import validate_api_token, validate_drive_token
+from api.deps.jobs import upload_jobs
 from api.deps.utils import APIException, get_localization_data
 
 router = APIRouter(
@@ -120,7 +121,6 @@ async def patient_screenings(
 )
 async def patient_studies(
     patient_id: str,
-    creds=Depends(validate_drive_token),
     user_id: int = Depends(validate_api_token),
     translation=Depends(get_localization_data)
 ):
@@ -129,13 +129,8 @@ async def patient_studies(
         user_id=user_id
     )
 
-    service = build("drive", "v3", credentials=creds)
-    folder_id = upload.get_drive_folder_id(service, translation)
-    files = upload.get_drive_folder_content(service, folder_id)
-
     studies_series = utils.get_screenings_and_mri_files_per_patient(
-        screenings=screenings,
-        files=files
+        screenings=screenings
     )
 
     return studies_series
@@ -147,7 +142,6 @@ async def patient_studies(
 )
 async def screening_files(
     screening_id: int,
-    creds=Depends(validate_drive_token),
     user_id: int = Depends(validate_api_token),
     translation=Depends(get_localization_data)
 ):
@@ -158,14 +152,10 @@ async def screening_files(
             content={"message": translation["screening_not_found"]},
         )
 
-    service = build("drive", "v3", credentials=creds)
-    folder_id = upload.get_drive_folder_id(service, translation)
-    # list the folder content
-    files = upload.get_drive_folder_content(service, folder_id)
-
+    # Files deleted in Drive are flagged by reconciler in scheduler
     user = await crud.get_user_by_id(user_id)
     mri_files = await utils.get_mri_files_and_annotations_per_screening(
-        user=user, files=files, screening_id=screening_id
+        user=user, screening_id=screening_id
     )
     return {
         "mri_files": mri_files
@@ -202,10 +192,13 @@ async def create_screening(
 
 @router.post(
     "/screening/{screening_id}/files",
-    response_model=s.PatientFiles
+    response_model=s.PatientFiles,
+    responses={202: {"model": s.UploadJob}}
 )
 async def upload_mri(
     screening_id: int,
+    request: Request,
+    background: bool = False,
     user_id: int = Depends(validate_api_token),
     creds=Depends(validate_drive_token),
     files: List[UploadFile] = File(...),
@@ -216,19 +209,26 @@ async def upload_mri(
         user_id=user_id,
         creds=creds,
         files=files,
-        translation=translation
+        translation=translation,
+        request=request,
+        background=background
     )
+    if background:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=mri)
 
     return {"mri_files": [mri]}
 
 
 @router.post(
     "/screening/{screening_id}/files/{series_uid}",
-    response_model=s.PatientFiles
+    response_model=s.PatientFiles,
+    responses={202: {"model": s.UploadJob}}
 )
 async def upload_mri(
     screening_id: int,
     series_uid: str,
+    request: Request,
+    background: bool = False,
     user_id: int = Depends(validate_api_token),
     creds=Depends(validate_drive_token),
     files: List[UploadFile] = File(...),
@@ -240,12 +240,35 @@ async def upload_mri(
         user_id=user_id,
         creds=creds,
         files=files,
-        translation=translation
+        translation=translation,
+        request=request,
+        background=background
     )
+    if background:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=mri)
 
     return {"mri_files": [mri]}
 
 
+@router.get(
+    "/upload-jobs/{job_id}",
+    response_model=s.UploadJob
+)
+async def upload_job(
+    job_id: str,
+    user_id: int = Depends(validate_api_token),
+    translation=Depends(get_localization_data)
+):
+    job = upload_jobs.get(job_id, user_id)
+    if job is None:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["upload_job_not_found"]},
+        )
+
+    return job.info()
+
+
 async def pacs_mri_upload(
     screening_id: int,
     user_id,
@@ -253,6 +276,8 @@ async def pacs_mri_upload(
     files,
     translation,
     series_uid: str = None,
+    request: Request | None = None,
+    background: bool = False
 ):
     screening = await crud.get_screening_by_id_and_user(screening_id, user_id)
     if screening is None:
@@ -261,19 +286,48 @@ async def pacs_mri_upload(
             content={"message": translation["screening_not_found"]},
         )
 
-    mri = await upload.mri_upload(
-        files,
-        creds,
-        screening.patient_id, 
-        screening_id, 
-        user_id, 
-        translation,
-        series_uid
-    )
+    async def pipeline(files, progress=None):
+        mri = await upload.mri_upload(
+            files,
+            creds,
+            screening.patient_id,
+            screening_id,
+            user_id,
+            translation,
+            series_uid,
+            None if background else request,
+            progress
+        )
 
-    if const.AZUREML.ENABLED is True:
-        await upload.mri_auto_annotate(
-            mri, screening.patient_id, user_id, translation
+        # Reused upload has its AI annotation already
+        try:
+            if const.AZUREML.ENABLED is True and not mri.get("duplicate"):
+                if progress is not None:
+                    progress(jobs.INFERENCE_QUEUED)
+                await upload.mri_auto_annotate(
+                    mri,
+                    screening.patient_id,
+                    user_id,
+                    request.app.clients,
+                    translation
+                )
+        finally:
+            # Inference stages its own copy of content
+            upload.close_content(mri)
+
+        return mri
+
+    if background:
+        # Files are spooled and processed after response is sent
+        job = await upload_jobs.submit(
+            files,
+            user_id,
+            screening_id,
+            pipeline,
+            request.app.clients,
+            translation
         )
+        return job.info()
+
+    return await pipeline(files)
 
-    return mri
\ No newline at end of file
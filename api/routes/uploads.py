@@ -0,0 +1,187 @@
+from fastapi import APIRouter, Depends, Header, Request, status
+from fastapi.responses import JSONResponse
+
+import api.deps.schema as s
+from api.db import crud
+from api.deps import const
+from api.deps.auth import validate_api_token, validate_drive_token
+from api.deps.resumable import upload_sessions
+from api.deps.utils import APIException, get_localization_data, parse_content_range
+from api.routes.patient import pacs_mri_upload
+
+router = APIRouter(
+    prefix="/uploads",
+    tags=["uploads"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def get_session(session_id: str, user_id: int, translation):
+    session = upload_sessions.get(session_id, user_id)
+    if session is None:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["upload_session_not_found"]},
+        )
+
+    return session
+
+
+@router.post(
+    "",
+    response_model=s.UploadSession,
+    status_code=status.HTTP_201_CREATED
+)
+async def create_upload_session(
+    upload: s.UploadSessionCreate,
+    user_id: int = Depends(validate_api_token),
+    translation=Depends(get_localization_data)
+):
+    screening = await crud.get_screening_by_id_and_user(
+        upload.screening_id, user_id
+    )
+    if screening is None:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["screening_not_found"]},
+        )
+
+    if (
+        not upload.files
+        or len(upload.files) > const.UPLOAD_SESSIONS.MAX_FILES
+        or sum(f.size for f in upload.files) > const.UPLOAD_SESSIONS.MAX_BYTES
+    ):
+        raise APIException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"message": translation["upload_session_invalid"]},
+        )
+
+    session = upload_sessions.create(
+        user_id=user_id,
+        screening_id=upload.screening_id,
+        series_uid=upload.series_uid,
+        files=[f.dict() for f in upload.files]
+    )
+    return session.info()
+
+
+@router.get(
+    "/{session_id}",
+    response_model=s.UploadSession
+)
+async def upload_session(
+    session_id: str,
+    user_id: int = Depends(validate_api_token),
+    translation=Depends(get_localization_data)
+):
+    return get_session(session_id, user_id, translation).info()
+
+
+@router.put(
+    "/{session_id}/files/{index}",
+    response_model=s.UploadSessionFileStatus
+)
+async def upload_chunk(
+    session_id: str,
+    index: int,
+    request: Request,
+    content_range: str | None = Header(default=None),
+    user_id: int = Depends(validate_api_token),
+    translation=Depends(get_localization_data)
+):
+    session = get_session(session_id, user_id, translation)
+    if not 0 <= index < len(session.files):
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": translation["upload_session_not_found"]},
+        )
+
+    size = session.files[index]["size"]
+    if size == 0:
+        # Empty file is received already
+        return session.file_status(index)
+
+    try:
+        start, end, total = parse_content_range(content_range)
+        if total != size:
+            raise ValueError("Content-Range total does not match file size")
+    except ValueError:
+        raise APIException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            content={"message": translation["upload_chunk_invalid"]},
+        )
+
+    if not await session.write(index, start, end, request.stream()):
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": translation["upload_chunk_invalid"]},
+        )
+
+    return session.file_status(index)
+
+
+@router.post(
+    "/{session_id}/finalize",
+    response_model=s.PatientFiles,
+    responses={202: {"model": s.UploadJob}}
+)
+async def finalize_upload_session(
+    session_id: str,
+    request: Request,
+    background: bool = False,
+    user_id: int = Depends(validate_api_token),
+    creds=Depends(validate_drive_token),
+    translation=Depends(get_localization_data)
+):
+    session = get_session(session_id, user_id, translation)
+    if not session.complete():
+        raise APIException(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"message": translation["upload_session_incomplete"]},
+        )
+
+    if not session.lock():
+        raise APIException(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"message": translation["upload_session_finalizing"]},
+        )
+
+    files = session.open_files()
+    try:
+        mri = await pacs_mri_upload(
+            screening_id=session.screening_id,
+            series_uid=session.series_uid,
+            user_id=user_id,
+            creds=creds,
+            files=files,
+            translation=translation,
+            request=request,
+            background=background
+        )
+    except BaseException:
+        # Keep received chunks, so finalize can be retried
+        session.unlock()
+        raise
+    finally:
+        for f in files:
+            f.file.close()
+
+    # Background job works on its own spooled copy of files
+    upload_sessions.remove(session)
+    if background:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=mri)
+
+    return {"mri_files": [mri]}
+
+
+@router.delete(
+    "/{session_id}",
+    status_code=status.HTTP_204_NO_CONTENT
+)
+async def remove_upload_session(
+    session_id: str,
+    user_id: int = Depends(validate_api_token),
+    translation=Depends(get_localization_data)
+):
+    session = get_session(session_id, user_id, translation)
+    upload_sessions.remove(session)
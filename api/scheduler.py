@@ -1,39 +1,111 @@
+import asyncio
+import logging
+import datetime
+
 from rocketry import Rocketry
 from rocketry.conds import every
 
-from api.deps.inference import MLInference
-from api.deps import upload
+from api.deps.executor import executors, POLL
+from api.deps.inference import ml_inference, notify, poll_delay, COMPLETED, FAILED
+from api.deps.results import inference_results
+from api.deps.submissions import inference_submissions
+from api.deps import upload, const
 from api.db import crud
 from api.api import app as app_fastapi
 
 app = Rocketry(config={"task_execution": "async"})
+log = logging.getLogger(const.APP_NAME)
+
+
+async def check_status(job_name: str) -> str | None:
+    try:
+        return await executors.run(POLL, ml_inference.job_status, job_name)
+    except Exception:
+        # Single unreachable job doesn't stop checks of the others
+        log.warning(
+            f"Status of inference job '{job_name}' was not checked.",
+            extra={"topic": "INFERENCE"}
+        )
+        return None
+
+
+def timed_out(annotation, now: datetime.datetime) -> bool:
+    started_at = annotation.job_started_at or annotation.created_at
+    timeout = datetime.timedelta(seconds=const.AZUREML.JOB_TIMEOUT_SECONDS)
+    return now - started_at > timeout
+
+
+async def fail_lost_inferences(now: datetime.datetime, clients: dict):
+    # Staging of MRIs is lost with restarted process, their job never starts
+    timeout = datetime.timedelta(seconds=const.AZUREML.LAUNCH_TIMEOUT_SECONDS)
+    for annotation in await crud.get_queued_inferences(now - timeout):
+        if inference_submissions.is_queued(annotation.id):
+            continue
+        await crud.fail_inference(annotation.id)
+        log.warning(
+            f"Inference of annotation {annotation.id} was not launched, "
+            f"annotation marked failed.",
+            extra={"topic": "INFERENCE"}
+        )
+        await notify(annotation, clients, failed=True)
 
 
 @app.task(every("1 minutes", based="finish"))
 async def check_done_inference():
-    ml = MLInference()
-    active_inferences = await crud.get_running_inferences()
+    now = datetime.datetime.now()
+    clients = app_fastapi.clients
+    await fail_lost_inferences(now, clients)
 
-    for annotation in active_inferences:
+    # Only jobs due for check, results being stored are not checked again.
+    # Batched MRIs share job, its status is checked once.
+    jobs = {}
+    for annotation in await crud.get_running_inferences(now):
+        if not inference_results.is_pending(annotation.job_name):
+            jobs.setdefault(annotation.job_name, []).append(annotation)
 
-        mri = ml.complete(annotation.job_name)
-        if mri is not None:
-            refresh_token = annotation.creator.refresh_token
-            uploaded_file = upload.drive_upload(mri, refresh_token)
+    # Checks run concurrently, bounded by POLL executor
+    statuses = await asyncio.gather(*(check_status(job) for job in jobs))
 
-            await crud.update_annotation_uploaded_file(
-                id=annotation.id,
-                filename=uploaded_file["name"],
-                file_id=uploaded_file["id"],
-                job_name=None       # Mark job as finished
-            )
+    schedule = {}
+    for (job_name, annotations), status in zip(jobs.items(), statuses):
+        if status == COMPLETED:
+            inference_results.submit(job_name, annotations, clients)
+        elif status in FAILED:
+            for annotation in annotations:
+                await inference_results.fail(
+                    annotation, f"ended as {status}", clients
+                )
+            continue
+        elif timed_out(annotations[0], now):
+            try:
+                await executors.run(POLL, ml_inference.cancel, job_name)
+            except Exception:
+                # Job is not polled anymore, cancellation is best effort
+                pass
+            for annotation in annotations:
+                await inference_results.fail(annotation, "timed out", clients)
+            continue
+
+        # Completed job is checked again only if its results are not stored
+        notified = inference_results.is_notified(job_name)
+        for annotation in annotations:
+            poll_count = annotation.poll_count + 1
+            delay = poll_delay(poll_count, notified)
+            schedule[annotation.id] = (now + delay, poll_count)
 
-            data = {
-                "annotation_id": annotation.id,
-                "user_id": annotation.created_by,
-                "mri_id": annotation.mri_file_id,
-                "screening_id": annotation.mri_file.screening_id,
-            }
+    if schedule:
+        await crud.reschedule_inferences(schedule)
 
-            if annotation.created_by in app_fastapi.clients:
-                await app_fastapi.clients[annotation.created_by].put(data)
+
+@app.task(every(const.GoogleAPI.RECONCILE_INTERVAL, based="finish"))
+async def reconcile_drive_files():
+    for user in await crud.get_drive_users():
+        try:
+            await upload.reconcile_drive_files(user)
+        except Exception:
+            # Authorization revoked in Google or Drive unavailable,
+            # flags stay as they are until next run
+            log.warning(
+                f"Drive files of user '{user.username}' were not reconciled.",
+                extra={"topic": "GOOGLE"}
+            )
@@ -8,6 +8,7 @@ import gzip
 import nibabel as nib
 import skimage
 import logging
+import urllib.request
 
 def dice_metrics(y_true, y_pred, axis=(1, 2, 3, 4)):
     """Calculate Dice similarity between labels and predictions.
@@ -389,6 +390,34 @@ def init():
     # model2=tf.keras.Model(inputs=inputs, outputs=x, name="unet")
     # model=model2
 
+def notify_completion():
+    """Tell NeurAI API that this worker wrote all its outputs, so it checks
+    the job right away instead of waiting for its next poll. Every worker
+    process of the job calls back once, API waits for the job to finish.
+    Callback URL and secret are environment variables of the deployment,
+    without URL nothing is sent. Failed callback never fails scoring, API
+    polls as fallback.
+    """
+    callback_url = os.environ.get("NEURAI_CALLBACK_URL")
+    if not callback_url:
+        return
+
+    # Batch endpoint job is the root run of this scoring step
+    job_name = os.environ.get("AZUREML_ROOT_RUN_ID") or os.environ.get("AZUREML_RUN_ID")
+    request = urllib.request.Request(
+        callback_url,
+        data=json.dumps({"job_name": job_name}).encode(),
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + os.environ.get("NEURAI_CALLBACK_SECRET", "")
+        },
+        method="POST"
+    )
+    try:
+        urllib.request.urlopen(request, timeout=10).close()
+    except Exception as e:
+        logging.warning("Completion callback failed: %s", e)
+
 def run(batch):
     outputfilenames = []
     for filepath in batch:
@@ -399,5 +428,9 @@ def run(batch):
         outputfilenames.append(outputfilename)
         nib.save(imgout, outputfilename)
     return outputfilenames
+
+def shutdown():
+    # run() is called per mini-batch, worker finishes after the last one
+    notify_completion()
         
     
\ No newline at end of file
@@ -0,0 +1,41 @@
+import os
+from io import BytesIO
+
+import pytest
+from buffered_encryption.aesctr import EncryptionIterator
+
+from api.deps import const
+from api.deps.crypto import EncryptedReader, ctr_cipher
+
+
+PLAINTEXT = os.urandom(100_000)
+CIPHERTEXT = b"".join(
+    EncryptionIterator(BytesIO(PLAINTEXT), const.ENC.KEY, const.ENC.SIG)
+)
+
+
+@pytest.mark.parametrize("offset", [0, 1, 15, 16, 17, 4095, 65537, 99_999])
+@pytest.mark.parametrize("size", [1, 16, 1000, -1])
+def test_encrypted_reader_matches_buffered_encryption(offset, size):
+    reader = EncryptedReader(BytesIO(PLAINTEXT))
+    reader.seek(offset)
+    end = None if size == -1 else offset + size
+    assert reader.read(size) == CIPHERTEXT[offset:end]
+
+
+def test_encrypted_reader_sequential_reads():
+    reader = EncryptedReader(BytesIO(PLAINTEXT))
+    chunks = []
+    while chunk := reader.read(7777):
+        chunks.append(chunk)
+    assert b"".join(chunks) == CIPHERTEXT
+
+
+def test_encrypted_reader_size():
+    reader = EncryptedReader(BytesIO(PLAINTEXT))
+    assert reader.seek(0, os.SEEK_END) == len(PLAINTEXT)
+
+
+@pytest.mark.parametrize("offset", [0, 5, 16, 33, 99_000])
+def test_ctr_cipher_decrypts_from_offset(offset):
+    assert ctr_cipher(offset).update(CIPHERTEXT[offset:]) == PLAINTEXT[offset:]
@@ -0,0 +1,96 @@
+import os
+import asyncio
+from io import BytesIO
+
+from api.deps import drive, storage, upload
+from api.deps.drive_async import drive_client
+from api.deps.drive_fake import fake_drive
+from api.deps.executor import executors
+from api.deps.mri_file import MRIFile
+
+
+CONTENT = os.urandom(3 * 1024 * 1024 + 123)
+TRANSLATION = {
+    "drive_rate_limited": "drive_rate_limited",
+    "drive_authorization_failed": "drive_authorization_failed",
+    "drive_request_failed": "drive_request_failed",
+    "file_not_found": "file_not_found",
+    "storage_request_failed": "storage_request_failed"
+}
+
+
+def test_fake_drive_is_configured():
+    assert fake_drive is not None
+
+
+def test_upload_list_download_delete():
+    async def flow():
+        creds = fake_drive.authorize("flow")
+        # Folder is created on authorization of Drive
+        folder_id = await drive_client.create_folder(creds)
+        assert await drive_client.verify_folder(creds, folder_id) == folder_id
+        backend = storage.default_backend(creds, folder_id)
+        assert isinstance(backend, storage.DriveStorage)
+
+        file_ids = []
+        for name in ("first.nii.gz", "second.nii.gz"):
+            uploaded_file = await MRIFile(name, BytesIO(CONTENT)).store(backend)
+            file_ids.append(uploaded_file["id"])
+
+        service = drive.service(creds)
+        listed = await executors.run(
+            backend.category, drive.list_folder, service, folder_id
+        )
+        assert sorted(f["id"] for f in listed) == sorted(file_ids)
+
+        # Ciphertext is stored, decrypted stream of any range is plaintext
+        f_e = MRIFile(filename="", content="")
+        reader = storage.backend_for(file_ids[0], creds)
+        size = await executors.run(
+            reader.category, f_e.download_size, reader, file_ids[0]
+        )
+        assert size == len(CONTENT)
+        for start, end in [(0, 99), (1000, 300_000), (len(CONTENT) - 10, None)]:
+            chunks = await executors.run(
+                reader.category,
+                lambda: b"".join(
+                    f_e.download_decrypted_stream(reader, file_ids[0], start, end)
+                )
+            )
+            assert chunks == CONTENT[start:None if end is None else end + 1]
+
+        errors = await upload.delete_files(creds, file_ids, TRANSLATION)
+        assert errors == {}
+        listed = await executors.run(
+            backend.category, drive.list_folder, service, folder_id
+        )
+        assert listed == []
+
+    asyncio.run(flow())
+
+
+def test_delete_missing_file_reports_error():
+    async def flow():
+        creds = fake_drive.authorize("missing")
+        errors = await upload.delete_files(creds, ["missing"], TRANSLATION)
+        assert errors["missing"].status_code == 404
+
+    asyncio.run(flow())
+
+
+def test_local_backend_round_trip():
+    async def flow():
+        backend = storage.backends[storage.LOCAL]
+        uploaded_file = await MRIFile("local.nii.gz", BytesIO(CONTENT)).store(backend)
+        file_id = uploaded_file["id"]
+        assert storage.parse_key(file_id)[0] == storage.LOCAL
+
+        f_e = MRIFile(filename="", content="")
+        reader = storage.backend_for(file_id)
+        chunks = b"".join(f_e.download_decrypted_stream(reader, file_id, 10, 20))
+        assert chunks == CONTENT[10:21]
+
+        errors = await upload.delete_files(None, [file_id], TRANSLATION)
+        assert errors == {}
+
+    asyncio.run(flow())
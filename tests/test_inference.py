@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+from api.deps import const
+from api.deps.inference import ml_inference, poll_delay
+
+
+@pytest.fixture
+def polling(monkeypatch):
+    monkeypatch.setattr(const.AZUREML, "POLL_FIRST_SECONDS", 240)
+    monkeypatch.setattr(const.AZUREML, "POLL_INTERVAL_SECONDS", 60)
+    monkeypatch.setattr(const.AZUREML, "POLL_MAX_SECONDS", 900)
+    monkeypatch.setattr(const.AZUREML, "CALLBACK_ENABLED", False)
+
+
+@pytest.mark.parametrize("poll_count, seconds", [
+    (0, 240), (1, 60), (2, 120), (3, 240), (4, 480), (5, 900), (20, 900)
+])
+def test_poll_delay_backs_off(polling, poll_count, seconds):
+    assert poll_delay(poll_count) == datetime.timedelta(seconds=seconds)
+
+
+def test_poll_delay_with_callbacks(polling, monkeypatch):
+    monkeypatch.setattr(const.AZUREML, "CALLBACK_ENABLED", True)
+    # Polling is only safety net, job which called back is checked as usual
+    assert poll_delay(0) == datetime.timedelta(seconds=900)
+    assert poll_delay(2) == datetime.timedelta(seconds=900)
+    assert poll_delay(2, notified=True) == datetime.timedelta(seconds=120)
+
+
+def test_load_results_by_input_name(tmp_path):
+    (tmp_path / "1.nii.gz").write_bytes(b"first")
+    (tmp_path / "2.nii.gz").write_bytes(b"second")
+    (tmp_path / "predictions.csv").write_bytes(b"")
+
+    results = ml_inference._load_results(
+        tmp_path, ["1.nii.gz", "2.nii.gz", "3.nii.gz"]
+    )
+
+    assert set(results) == {"1.nii.gz", "2.nii.gz", "3.nii.gz"}
+    assert results["1.nii.gz"].content.read() == b"first"
+    assert results["2.nii.gz"].content.read() == b"second"
+    assert results["3.nii.gz"] is None
+
+
+def test_load_results_of_single_file_job(tmp_path):
+    (tmp_path / "output.nii.gz").write_bytes(b"only")
+
+    results = ml_inference._load_results(tmp_path, [None])
+
+    assert results[None].content.read() == b"only"
+
+
+def test_load_results_of_single_file_job_ambiguous(tmp_path):
+    (tmp_path / "a.nii.gz").write_bytes(b"a")
+    (tmp_path / "b.nii.gz").write_bytes(b"b")
+
+    assert ml_inference._load_results(tmp_path, [None]) == {None: None}
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from api.deps import throttle
+from api.deps.throttle import DriveThrottle, TokenBucket
+
+
+def rate_limit_content(reason: str) -> bytes:
+    return json.dumps({"error": {"errors": [{"reason": reason}]}}).encode()
+
+
+def test_token_bucket_burst_then_waits(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(throttle.time, "monotonic", lambda: now[0])
+
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # Waiting requests are served in order of arrival
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+    now[0] += 10
+    assert bucket.reserve() == 0
+
+
+@pytest.fixture
+def drive_throttle():
+    return DriveThrottle(
+        rate=10,
+        burst=20,
+        max_retries=3,
+        backoff_base=1,
+        backoff_max=32,
+        upload_limit=4
+    )
+
+
+@pytest.mark.parametrize("status_code, content", [
+    (None, b""),
+    (500, b""),
+    (503, b""),
+    (429, b""),
+    (403, rate_limit_content("userRateLimitExceeded")),
+])
+def test_should_retry_idempotent(drive_throttle, status_code, content):
+    assert drive_throttle.should_retry(0, status_code, content) is True
+
+
+@pytest.mark.parametrize("status_code, content", [
+    (400, b""),
+    (404, b""),
+    (403, rate_limit_content("insufficientPermissions")),
+])
+def test_should_not_retry_client_error(drive_throttle, status_code, content):
+    assert drive_throttle.should_retry(0, status_code, content) is False
+
+
+@pytest.mark.parametrize("status_code, content, expected", [
+    (429, b"", True),
+    (403, rate_limit_content("rateLimitExceeded"), True),
+    (None, b"", False),
+    (500, b"", False),
+    (503, b"", False),
+])
+def test_should_retry_non_idempotent_only_rate_limited(
+    drive_throttle, status_code, content, expected
+):
+    retry = drive_throttle.should_retry(0, status_code, content, idempotent=False)
+    assert retry is expected
+
+
+def test_should_retry_gives_up(drive_throttle):
+    assert drive_throttle.should_retry(2, 503) is True
+    assert drive_throttle.should_retry(3, 503) is False
+    assert drive_throttle.gave_up == 1
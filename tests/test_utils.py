@@ -0,0 +1,45 @@
+import pytest
+
+from api.deps.utils import parse_content_range, parse_range_header
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=900-2000", (900, 999)),
+    ("bytes=-2000", (0, 999)),
+])
+def test_parse_range_header(value, expected):
+    assert parse_range_header(value, 1000) == expected
+
+
+@pytest.mark.parametrize("value", [
+    None, "", "items=0-1", "bytes=0-1,5-6", "bytes=a-b"
+])
+def test_parse_range_header_whole_content(value):
+    assert parse_range_header(value, 1000) is None
+
+
+@pytest.mark.parametrize("value", ["bytes=1000-", "bytes=500-100"])
+def test_parse_range_header_unsatisfiable(value):
+    with pytest.raises(ValueError):
+        parse_range_header(value, 1000)
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 0-99/1000") == (0, 99, 1000)
+    assert parse_content_range("bytes 900-999/1000") == (900, 999, 1000)
+
+
+@pytest.mark.parametrize("value", [
+    None,
+    "0-99/1000",
+    "bytes 100-99/1000",
+    "bytes 0-1000/1000",
+    "bytes a-b/c",
+    "bytes 0-99/*",
+])
+def test_parse_content_range_invalid(value):
+    with pytest.raises(ValueError):
+        parse_content_range(value)